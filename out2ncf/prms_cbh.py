@@ -2,7 +2,7 @@
 # Wed Mar 13 09:43:53 MDT 2019
 
 #import os
-from prms_utils import csv_reader
+from prms_utils import cbh_reader
 import numpy as np
 import csv
 
@@ -10,6 +10,7 @@ import csv
 #from prms_utils import datafile_reader
 # from prms_utils import get_dim_list
 from prms_utils import cdl_writer
+from prms_utils import ncf_writer
 # import fiona
 # from netCDF4 import Dataset
 #
@@ -41,43 +42,71 @@ in_dir = dir + "/prms_files"
 # Output nc file
 out_dir = dir + "/input"
 
-cdl_file_name = out_dir + '/nhm_cbh_example_short.cdl'
+# Either of these can be None to skip writing it. The netcdf file is written directly; the cdl file has to go
+# through ncgen.
+ncf_file_name = out_dir + '/nhm_cbh_example_short.nc'
+cdl_file_name = None
+# cdl_file_name = out_dir + '/nhm_cbh_example_short.cdl'
 #cdl_file_name = in_dir + '/nhm_output_example.cdl'
 
+# Storage of the netcdf time series (see prms_utils/ncf_writer.py)
+ncf_storage = ncf_writer.map_storage
+
+# Attributes of the netcdf and cdl variables
+ncf_attrs = {
+    'hru_lat': {'dimid': 'hruid', 'long_name': 'Latitude of HRU centroid',
+        'units': 'degrees_north', 'standard_name': 'hru_latitude'},
+    'hru_lon': {'dimid': 'hruid', 'long_name': 'Longitude of HRU centroid',
+        'units': 'degrees_east', 'standard_name': 'hru_longitude'},
+    'prcp': {'dimid': 'hruid', 'long_name': 'Daily precipitation rate',
+        'units': 'mm/day', 'standard_name': 'lwe_precipitation_rate'},
+    'tmax': {'dimid': 'hruid', 'long_name': 'Maximum daily air temperature',
+        'units': 'degree_Celsius', 'standard_name': 'maximum_daily_air_temperature'},
+    'tmin': {'dimid': 'hruid', 'long_name': 'Minimum daily air temperature',
+        'units': 'degree_Celsius', 'standard_name': 'minimum_daily_air_temperature'},
+}
+
+
+# Read a PRMS CBH file, header and all. Returns the number of time steps, the number of HRUs, the base date
+# (YYYY-MM-DD) and the values.
+def read_cbh(cbhfn):
+    var_names, var_counts, dates, vals = cbh_reader.read(cbhfn)
+    return len(dates), vals.shape[1], str(dates[0]), vals
+
 
 def main():
 # Read the PRMS CBH
-    nts, nhrus, base_date, foo = csv_reader.read_cbh(in_dir + '/' + 'prcp_short.csv')
-    prcp_vals = [num * 25.4 for num in foo] # convert inches to mm
+    nts, nhrus, base_date, foo = read_cbh(in_dir + '/' + 'prcp.cbh')
+    prcp_vals = foo * 25.4 # convert inches to mm
     print nts, nhrus, base_date
     print prcp_vals[0][nhrus-1], prcp_vals[nts-1][0], prcp_vals[nts-1][nhrus-1]
 
-    nts1, nhrus1, base_date1, foo = csv_reader.read_cbh(in_dir + '/' + 'tmax_short.csv')
-    tmax_vals = [(num -32.0) * 5.0/9.0 for num in foo] # convert F to C
+    nts1, nhrus1, base_date1, foo = read_cbh(in_dir + '/' + 'tmax.cbh')
+    tmax_vals = (foo - 32.0) * 5.0 / 9.0 # convert F to C
     print nts, nhrus, base_date
     print tmax_vals[0][nhrus-1], tmax_vals[nts-1][0], tmax_vals[nts-1][nhrus-1]
 
     if nts != nts1:
-        raise ValueError('number of timesteps not the same in prcp_short.csv and tmax_short.csv')
+        raise ValueError('number of timesteps not the same in prcp.cbh and tmax.cbh')
 
     if nhrus != nhrus1:
-        raise ValueError('number of hrus not the same in prcp_short.csv and tmax_short.csv')
+        raise ValueError('number of hrus not the same in prcp.cbh and tmax.cbh')
 
     if base_date != base_date1:
-        raise ValueError('base date not the same in prcp_short.csv and tmax_short.csv')
+        raise ValueError('base date not the same in prcp.cbh and tmax.cbh')
 
-    nts2, nhrus2, base_date2, foo = csv_reader.read_cbh(in_dir + '/' + 'tmin_short.csv')
-    tmin_vals = [(num - 32.0) * 5.0 / 9.0 for num in foo]  # convert F to C
+    nts2, nhrus2, base_date2, foo = read_cbh(in_dir + '/' + 'tmin.cbh')
+    tmin_vals = (foo - 32.0) * 5.0 / 9.0  # convert F to C
     print nts2, nhrus2, base_date2
     print tmin_vals[0][nhrus - 1], tmin_vals[nts - 1][0], tmin_vals[nts - 1][nhrus - 1]
     if nts != nts2:
-        raise ValueError('number of timesteps not the same in prcp_short.csv and tmin_short.csv')
+        raise ValueError('number of timesteps not the same in prcp.cbh and tmin.cbh')
 
     if nhrus != nhrus2:
-        raise ValueError('number of hrus not the same in prcp_short.csv and tmin_short.csv')
+        raise ValueError('number of hrus not the same in prcp.cbh and tmin.cbh')
 
     if base_date != base_date2:
-        raise ValueError('base date not the same in prcp_short.csv and tmin_short.csv')
+        raise ValueError('base date not the same in prcp.cbh and tmin.cbh')
 
     # hru_lat
     hru_lat_vals = np.zeros(shape=(nhrus))
@@ -97,133 +126,94 @@ def main():
             hru_lon_vals[ii] = float(row[0])
             ii = ii + 1
 
+# write the ncf file
+    if ncf_file_name is not None:
+        print 'writing netcdf file ' + ncf_file_name
+        georefs = [('hru_lat', ncf_attrs['hru_lat'], hru_lat_vals),
+                   ('hru_lon', ncf_attrs['hru_lon'], hru_lon_vals)]
+        timeseries = [('prcp', ncf_attrs['prcp'], prcp_vals),
+                      ('tmax', ncf_attrs['tmax'], tmax_vals),
+                      ('tmin', ncf_attrs['tmin'], tmin_vals)]
+        ncf_writer.write(ncf_file_name, base_date, tz_code, [('hruid', nhrus)], georefs, timeseries, 'prms_cbh.py',
+                         storage=ncf_storage)
+
 # write the cdl file
-    print 'writing cdl file ' + cdl_file_name
-    cdl_file = open(cdl_file_name, 'w')
-    cdl_file.write('netcdf ' + nc_name + ' {' + '\n')
-
-    # Write dimensions block
-    cdl_file.write('dimensions:\n')
-    cdl_file.write('  ' + 'time' + ' = ' + str(nts) + ';\n')
-    cdl_file.write('  ' + 'hruid' + ' = ' + str(nhrus) + ';\n')
-
-    # Write the variables block
-    cdl_file.write('variables:\n')
-
-    # Put in the indexes for the dimensions
-    key = 'time'
-    idname = key + 'id'
-    cdl_file.write('  int time(time);\n')
-    cdl_file.write('    time:long_name = "time";\n')
-    cdl_file.write('    time:standard_name = "time";\n')
-    cdl_file.write('    time:units = "days since ' + base_date +' 00:00' + tz_code + '";\n')
-
-    key = 'hru'
-    idname = key + 'id'
-    cdl_file.write('  int ' + idname + '(' + idname + ');\n')
-    cdl_file.write('    ' + idname + ':cf_role = "timeseries_id";\n')
-    cdl_file.write('    ' + idname + ':long_name = "local model ' + key + ' id";\n')
-
-    cdl_file.write('  float hru_lat(hruid);\n')
-    cdl_file.write('    hru_lat:long_name = "Latitude of HRU centroid";\n')
-    cdl_file.write('    hru_lat:units = "degrees_north";\n')
-    cdl_file.write('    hru_lat:standard_name = "hru_latitude";\n')
-
-    cdl_file.write('  float hru_lon(hruid);\n')
-    cdl_file.write('    hru_lon:long_name = "Longitude of HRU centroid";\n')
-    cdl_file.write('    hru_lon:units = "degrees_east";\n')
-    cdl_file.write('    hru_lon:standard_name = "hru_longitude";\n')
-
-    cdl_file.write('  float prcp(time, hruid);\n')
-    cdl_file.write('    prcp:long_name = "Daily precipitation rate";\n')
-    cdl_file.write('    prcp:units = "mm/day";\n')
-    cdl_file.write('    prcp:standard_name = "lwe_precipitation_rate";\n')
-
-    cdl_file.write('  float tmax(time, hruid);\n')
-    cdl_file.write('    tmax:long_name = "Maximum daily air temperature";\n')
-    cdl_file.write('    tmax:units = "degree_Celsius";\n')
-    cdl_file.write('    tmax:standard_name = "maximum_daily_air_temperature";\n')
-
-    cdl_file.write('  float tmin(time, hruid);\n')
-    cdl_file.write('    tmin:long_name = "Minimum daily air temperature";\n')
-    cdl_file.write('    tmin:units = "degree_Celsius";\n')
-    cdl_file.write('    tmin:standard_name = "minimum_daily_air_temperature";\n')
-
-    cdl_file.write('  // global attributes:\n')
-    cdl_file.write('  :Conventions = "CF-1.8";\n')
-    cdl_file.write('  :featureType = "timeSeries";\n')
-    cdl_file.write('  :history = "Thu Mar 21 11:22:48 MDT 2019,markstro,prms_cbh.py,\\n";\n')
-
-    # Write data
-    cdl_file.write('\ndata:\n\n')
+    if cdl_file_name is not None:
+        print 'writing cdl file ' + cdl_file_name
+        cdl_file = open(cdl_file_name, 'w')
+        cdl_file.write('netcdf ' + nc_name + ' {' + '\n')
+
+        # Write dimensions block
+        cdl_file.write('dimensions:\n')
+        cdl_file.write('  ' + 'time' + ' = ' + str(nts) + ';\n')
+        cdl_file.write('  ' + 'hruid' + ' = ' + str(nhrus) + ';\n')
+
+        # Write the variables block
+        cdl_file.write('variables:\n')
+
+        # Put in the indexes for the dimensions
+        key = 'time'
+        idname = key + 'id'
+        cdl_file.write('  int time(time);\n')
+        cdl_file.write('    time:long_name = "time";\n')
+        cdl_file.write('    time:standard_name = "time";\n')
+        cdl_file.write('    time:units = "days since ' + base_date +' 00:00' + tz_code + '";\n')
+
+        key = 'hru'
+        idname = key + 'id'
+        cdl_file.write('  int ' + idname + '(' + idname + ');\n')
+        cdl_file.write('    ' + idname + ':cf_role = "timeseries_id";\n')
+        cdl_file.write('    ' + idname + ':long_name = "local model ' + key + ' id";\n')
+
+        for name in ['hru_lat', 'hru_lon']:
+            cdl_writer.write_variable(cdl_file, name, ncf_attrs[name], ncf_attrs[name]['dimid'])
+
+        for name in ['prcp', 'tmax', 'tmin']:
+            cdl_writer.write_variable(cdl_file, name, ncf_attrs[name], 'time, ' + ncf_attrs[name]['dimid'])
+
+        cdl_file.write('  // global attributes:\n')
+        cdl_file.write('  :Conventions = "CF-1.8";\n')
+        cdl_file.write('  :featureType = "timeSeries";\n')
+        cdl_file.write('  :history = "Thu Mar 21 11:22:48 MDT 2019,markstro,prms_cbh.py,\\n";\n')
+
+        # Write data
+        cdl_file.write('\ndata:\n\n')
 
 # time
-    cdl_file.write('time =\n')
-    cdl_file.write('  0')
-    for ii in xrange(1, nts):
-        cdl_file.write(', ' + str(ii))
-    cdl_file.write(';\n\n')
+        cdl_file.write('time =\n')
+        cdl_file.write('  0')
+        for ii in xrange(1, nts):
+            cdl_file.write(', ' + str(ii))
+        cdl_file.write(';\n\n')
 
 # hruid
-    cdl_file.write('hruid =\n')
-    cdl_file.write('  1')
-    for ii in xrange(2, nhrus):
-        cdl_file.write(', ' + str(ii))
-    cdl_file.write(';\n\n')
+        cdl_file.write('hruid =\n')
+        cdl_file.write('  1')
+        for ii in xrange(2, nhrus + 1):
+            cdl_file.write(', ' + str(ii))
+        cdl_file.write(';\n\n')
 
 # latitude
-    cdl_file.write('hru_lat =\n')
-    cdl_file.write('  ' + str('%.6f' % hru_lat_vals[0]))
-    for ii in xrange(1, nhrus):
-        cdl_file.write(', ' + str('%.6f' % hru_lat_vals[ii]))
-    cdl_file.write(';\n\n')
+        cdl_file.write('hru_lat =\n')
+        cdl_file.write('  ' + str('%.6f' % hru_lat_vals[0]))
+        for ii in xrange(1, nhrus):
+            cdl_file.write(', ' + str('%.6f' % hru_lat_vals[ii]))
+        cdl_file.write(';\n\n')
 
 # longitude
-    cdl_file.write('hru_lon =\n')
-    cdl_file.write('  ' + str('%.6f' % hru_lon_vals[0]))
-    for ii in xrange(1, nhrus):
-        cdl_file.write(', ' + str('%.6f' % hru_lon_vals[ii]))
-    cdl_file.write(';\n\n')
-
-# soil_moist
-    cdl_file.write('prcp =\n')
-    for ii in xrange(0, nts):
-        cdl_file.write('  ' + str('%.1f' % prcp_vals[ii][0]))
-        for jj in xrange(1, nhrus):
-            cdl_file.write(', ' + str('%.1f' % prcp_vals[ii][jj]))
-        if ii == nts-1:
-            cdl_file.write('\n')
-        else:
-            cdl_file.write(',\n')
-    cdl_file.write(';\n\n')
-
-# runoff
-    cdl_file.write('tmax =\n')
-    for ii in xrange(0, nts):
-        cdl_file.write('  ' + str('%.1f' % tmax_vals[ii][0]))
-        for jj in xrange(1, nhrus):
-            cdl_file.write(', ' + str('%.1f' % tmax_vals[ii][jj]))
-        if ii == nts - 1:
-            cdl_file.write('\n')
-        else:
-            cdl_file.write(',\n')
-    cdl_file.write(';\n\n')
-
-# stream_flow
-    cdl_file.write('tmin =\n')
-    for ii in xrange(0, nts):
-        cdl_file.write('  ' + str('%.1f' % tmin_vals[ii][0]))
-        for jj in xrange(1, nhrus):
-            cdl_file.write(', ' + str('%.1f' % tmin_vals[ii][jj]))
-        if ii == nts - 1:
-            cdl_file.write('\n')
-        else:
-            cdl_file.write(',\n')
-    cdl_file.write(';\n\n')
-
-    # Close the cdl file
-    cdl_file.write('}\n')
-    cdl_file.close()
+        cdl_file.write('hru_lon =\n')
+        cdl_file.write('  ' + str('%.6f' % hru_lon_vals[0]))
+        for ii in xrange(1, nhrus):
+            cdl_file.write(', ' + str('%.6f' % hru_lon_vals[ii]))
+        cdl_file.write(';\n\n')
+
+        cdl_writer.write_timeseries_values(cdl_file, 'prcp', prcp_vals)
+        cdl_writer.write_timeseries_values(cdl_file, 'tmax', tmax_vals)
+        cdl_writer.write_timeseries_values(cdl_file, 'tmin', tmin_vals)
+
+        # Close the cdl file
+        cdl_file.write('}\n')
+        cdl_file.close()
 
 # at this point, missing_val_set contains the names of all values because nothing has been removed yet.
 #     print '1', missing_val_set
@@ -10,6 +10,7 @@ import csv
 #from prms_utils import datafile_reader
 # from prms_utils import get_dim_list
 from prms_utils import cdl_writer
+from prms_utils import ncf_writer
 # import fiona
 # from netCDF4 import Dataset
 #
@@ -41,9 +42,38 @@ in_dir = dir + "/prms_files"
 # Output nc file
 out_dir = dir + "/output"
 
-cdl_file_name = out_dir + '/nhm_output_example_short.cdl'
+# Either of these can be None to skip writing it. The netcdf file is written directly; the cdl file has to go
+# through ncgen.
+ncf_file_name = out_dir + '/nhm_output_example_short.nc'
+cdl_file_name = None
+# cdl_file_name = out_dir + '/nhm_output_example_short.cdl'
 #cdl_file_name = in_dir + '/nhm_output_example.cdl'
 
+# Storage of the netcdf time series (see prms_utils/ncf_writer.py)
+ncf_storage = ncf_writer.map_storage
+
+# _FillValue of the variables (the netcdf default fill value for floats)
+ncf_fill_value = 9.969209968386869e+36
+
+# Attributes of the netcdf and cdl variables
+ncf_attrs = {
+    'hru_lat': {'dimid': 'hruid', 'long_name': 'Latitude of HRU centroid',
+        'units': 'degrees_north', 'standard_name': 'hru_latitude', 'fill_value': ncf_fill_value},
+    'hru_lon': {'dimid': 'hruid', 'long_name': 'Longitude of HRU centroid',
+        'units': 'degrees_east', 'standard_name': 'hru_longitude', 'fill_value': ncf_fill_value},
+    'seg_lat': {'dimid': 'segid', 'long_name': 'Latitude of stream segment centroid',
+        'units': 'degrees_north', 'standard_name': 'segment_latitude', 'fill_value': ncf_fill_value},
+    'seg_lon': {'dimid': 'segid', 'long_name': 'Longitude of stream segment centroid',
+        'units': 'degrees_east', 'standard_name': 'segment_longitude', 'fill_value': ncf_fill_value},
+    'soil_moist': {'dimid': 'hruid', 'long_name': 'Soil moisture content',
+        'units': 'mm', 'standard_name': 'lwe_thickness_of_moisture_content_of_soil_layer',
+        'fill_value': ncf_fill_value},
+    'lateral_flow': {'dimid': 'hruid', 'long_name': 'Lateral flow from HRU into the corresponding stream segment',
+        'units': 'mm/day', 'standard_name': 'lateral_flow', 'fill_value': ncf_fill_value},
+    'streamflow': {'dimid': 'segid', 'long_name': 'Streamflow in channel',
+        'units': 'm3/s', 'standard_name': 'water_volume_transport_in_river_channel', 'fill_value': ncf_fill_value},
+}
+
 
 def main():
 # Read the PRMS output
@@ -121,178 +151,124 @@ def main():
             seg_lon_vals[ii] = float(row[0])
             ii = ii + 1
 
+# write the ncf file
+    if ncf_file_name is not None:
+        print 'writing netcdf file ' + ncf_file_name
+        georefs = [('hru_lat', ncf_attrs['hru_lat'], hru_lat_vals),
+                   ('hru_lon', ncf_attrs['hru_lon'], hru_lon_vals),
+                   ('seg_lat', ncf_attrs['seg_lat'], seg_lat_vals),
+                   ('seg_lon', ncf_attrs['seg_lon'], seg_lon_vals)]
+        timeseries = [('soil_moist', ncf_attrs['soil_moist'], soil_moist_vals),
+                      ('lateral_flow', ncf_attrs['lateral_flow'], runoff_vals),
+                      ('streamflow', ncf_attrs['streamflow'], seg_outflow_vals)]
+        ncf_writer.write(ncf_file_name, base_date, tz_code, [('hruid', nhrus), ('segid', nsegments)], georefs,
+                         timeseries, 'prms_outputs.py', storage=ncf_storage)
+
 # write the cdl file
-    print 'writing cdl file ' + cdl_file_name
-    cdl_file = open(cdl_file_name, 'w')
-    cdl_file.write('netcdf ' + nc_name + ' {' + '\n')
-
-    # Write dimensions block
-    cdl_file.write('dimensions:\n')
-    cdl_file.write('  ' + 'time' + ' = ' + str(nts) + ';\n')
-    cdl_file.write('  ' + 'hruid' + ' = ' + str(nhrus) + ';\n')
-    cdl_file.write('  ' + 'segid' + ' = ' + str(nsegments) + ';\n')
-
-    # Write the variables block
-    cdl_file.write('variables:\n')
-
-    # Put in the indexes for the dimensions
-    key = 'time'
-    idname = key + 'id'
-    cdl_file.write('  int time(time);\n')
-    cdl_file.write('    time:long_name = "time";\n')
-    cdl_file.write('    time:standard_name = "time";\n')
-    cdl_file.write('    time:units = "days since ' + base_date +' 00:00' + tz_code + '";\n')
-
-    key = 'hru'
-    idname = key + 'id'
-    cdl_file.write('  int ' + idname + '(' + idname + ');\n')
-    cdl_file.write('    ' + idname + ':cf_role = "timeseries_id";\n')
-    cdl_file.write('    ' + idname + ':long_name = "local model ' + key + ' id";\n')
-
-    key = 'seg'
-    idname = key + 'id'
-    cdl_file.write('  int ' + idname + '(' + idname + ');\n')
-    cdl_file.write('    ' + idname + ':cf_role = "timeseries_id";\n')
-    cdl_file.write('    ' + idname + ':long_name = "local model ' + key + ' id";\n')
-
-    cdl_file.write('  float hru_lat(hruid);\n')
-    cdl_file.write('    hru_lat:long_name = "Latitude of HRU centroid";\n')
-    cdl_file.write('    hru_lat:units = "degrees_north";\n')
-    cdl_file.write('    hru_lat:standard_name = "hru_latitude";\n')
-    cdl_file.write('    hru_lat:_FillValue = "9.969209968386869e+36";\n')
-
-    cdl_file.write('  float hru_lon(hruid);\n')
-    cdl_file.write('    hru_lon:long_name = "Longitude of HRU centroid";\n')
-    cdl_file.write('    hru_lon:units = "degrees_east";\n')
-    cdl_file.write('    hru_lon:standard_name = "hru_longitude";\n')
-    cdl_file.write('    hru_lon:_FillValue = "9.969209968386869e+36";\n')
-
-    cdl_file.write('  float seg_lat(segid);\n')
-    cdl_file.write('    seg_lat:long_name = "Latitude of stream segment centroid";\n')
-    cdl_file.write('    seg_lat:units = "degrees_north";\n')
-    cdl_file.write('    seg_lat:standard_name = "segment_latitude";\n')
-    cdl_file.write('    seg_lat:_FillValue = "9.969209968386869e+36";\n')
-
-    cdl_file.write('  float seg_lon(segid);\n')
-    cdl_file.write('    seg_lon:long_name = "Longitude of stream segment centroid";\n')
-    cdl_file.write('    seg_lon:units = "degrees_east";\n')
-    cdl_file.write('    seg_lon:standard_name = "segment_longitude";\n')
-    cdl_file.write('    seg_lon:_FillValue = "9.969209968386869e+36";\n')
-
-    cdl_file.write('  float soil_moist(time, hruid);\n')
-    cdl_file.write('    soil_moist:long_name = "Soil moisture content";\n')
-    cdl_file.write('    soil_moist:units = "mm";\n')
-    cdl_file.write('    soil_moist:standard_name = "lwe_thickness_of_moisture_content_of_soil_layer";\n')
-    cdl_file.write('    soil_moist:_FillValue = "9.969209968386869e+36";\n')
-
-    cdl_file.write('  float lateral_flow(time, hruid);\n')
-    cdl_file.write('    lateral_flow:long_name = "Lateral flow from HRU into the corresponding stream segment";\n')
-    cdl_file.write('    lateral_flow:units = "mm/day";\n')
-    cdl_file.write('    lateral_flow:standard_name = "lateral_flow";\n')
-    cdl_file.write('    lateral_flow:_FillValue = "9.969209968386869e+36";\n')
-
-    cdl_file.write('  float streamflow(time, hruid);\n')
-    cdl_file.write('    streamflow:long_name = "Streamflow in channel";\n')
-    cdl_file.write('    streamflow:units = "m3/s";\n')
-    cdl_file.write('    streamflow:standard_name = "water_volume_transport_in_river_channel";\n')
-    cdl_file.write('    streamflow:_FillValue = "9.969209968386869e+36";\n')
-
-    cdl_file.write('  // global attributes:\n')
-    cdl_file.write('  :Conventions = "CF-1.8";\n')
-    cdl_file.write('  :featureType = "timeSeries";\n')
-    cdl_file.write('  :history = "Thu Mar 14 17:25:14 MDT 2019,markstro,prms_outputs.py,\\nThu Mar 21 09:33:58 MDT 2019,markstro,prms_outputs.py,\\n";\n')
-
-    # Write data
-    cdl_file.write('\ndata:\n\n')
+    if cdl_file_name is not None:
+        print 'writing cdl file ' + cdl_file_name
+        cdl_file = open(cdl_file_name, 'w')
+        cdl_file.write('netcdf ' + nc_name + ' {' + '\n')
+
+        # Write dimensions block
+        cdl_file.write('dimensions:\n')
+        cdl_file.write('  ' + 'time' + ' = ' + str(nts) + ';\n')
+        cdl_file.write('  ' + 'hruid' + ' = ' + str(nhrus) + ';\n')
+        cdl_file.write('  ' + 'segid' + ' = ' + str(nsegments) + ';\n')
+
+        # Write the variables block
+        cdl_file.write('variables:\n')
+
+        # Put in the indexes for the dimensions
+        key = 'time'
+        idname = key + 'id'
+        cdl_file.write('  int time(time);\n')
+        cdl_file.write('    time:long_name = "time";\n')
+        cdl_file.write('    time:standard_name = "time";\n')
+        cdl_file.write('    time:units = "days since ' + base_date +' 00:00' + tz_code + '";\n')
+
+        key = 'hru'
+        idname = key + 'id'
+        cdl_file.write('  int ' + idname + '(' + idname + ');\n')
+        cdl_file.write('    ' + idname + ':cf_role = "timeseries_id";\n')
+        cdl_file.write('    ' + idname + ':long_name = "local model ' + key + ' id";\n')
+
+        key = 'seg'
+        idname = key + 'id'
+        cdl_file.write('  int ' + idname + '(' + idname + ');\n')
+        cdl_file.write('    ' + idname + ':cf_role = "timeseries_id";\n')
+        cdl_file.write('    ' + idname + ':long_name = "local model ' + key + ' id";\n')
+
+        for name in ['hru_lat', 'hru_lon', 'seg_lat', 'seg_lon']:
+            cdl_writer.write_variable(cdl_file, name, ncf_attrs[name], ncf_attrs[name]['dimid'])
+
+        for name in ['soil_moist', 'lateral_flow', 'streamflow']:
+            cdl_writer.write_variable(cdl_file, name, ncf_attrs[name], 'time, ' + ncf_attrs[name]['dimid'])
+
+        cdl_file.write('  // global attributes:\n')
+        cdl_file.write('  :Conventions = "CF-1.8";\n')
+        cdl_file.write('  :featureType = "timeSeries";\n')
+        cdl_file.write('  :history = "Thu Mar 14 17:25:14 MDT 2019,markstro,prms_outputs.py,\\nThu Mar 21 09:33:58 MDT 2019,markstro,prms_outputs.py,\\n";\n')
+
+        # Write data
+        cdl_file.write('\ndata:\n\n')
 
 # time
-    cdl_file.write('time =\n')
-    cdl_file.write('  0')
-    for ii in xrange(1, nts):
-        cdl_file.write(', ' + str(ii))
-    cdl_file.write(';\n\n')
+        cdl_file.write('time =\n')
+        cdl_file.write('  0')
+        for ii in xrange(1, nts):
+            cdl_file.write(', ' + str(ii))
+        cdl_file.write(';\n\n')
 
 # hruid
-    cdl_file.write('hruid =\n')
-    cdl_file.write('  1')
-    for ii in xrange(2, nhrus):
-        cdl_file.write(', ' + str(ii))
-    cdl_file.write(';\n\n')
+        cdl_file.write('hruid =\n')
+        cdl_file.write('  1')
+        for ii in xrange(2, nhrus + 1):
+            cdl_file.write(', ' + str(ii))
+        cdl_file.write(';\n\n')
 
 # segid
-    cdl_file.write('segid =\n')
-    cdl_file.write('  1')
-    for ii in xrange(2, nsegments):
-        cdl_file.write(', ' + str(ii))
-    cdl_file.write(';\n\n')
+        cdl_file.write('segid =\n')
+        cdl_file.write('  1')
+        for ii in xrange(2, nsegments + 1):
+            cdl_file.write(', ' + str(ii))
+        cdl_file.write(';\n\n')
 
 # latitude
-    cdl_file.write('hru_lat =\n')
-    cdl_file.write('  ' + str('%.6f' % hru_lat_vals[0]))
-    for ii in xrange(1, nhrus):
-        cdl_file.write(', ' + str('%.6f' % hru_lat_vals[ii]))
-    cdl_file.write(';\n\n')
+        cdl_file.write('hru_lat =\n')
+        cdl_file.write('  ' + str('%.6f' % hru_lat_vals[0]))
+        for ii in xrange(1, nhrus):
+            cdl_file.write(', ' + str('%.6f' % hru_lat_vals[ii]))
+        cdl_file.write(';\n\n')
 
 # longitude
-    cdl_file.write('hru_lon =\n')
-    cdl_file.write('  ' + str('%.6f' % hru_lon_vals[0]))
-    for ii in xrange(1, nhrus):
-        cdl_file.write(', ' + str('%.6f' % hru_lon_vals[ii]))
-    cdl_file.write(';\n\n')
+        cdl_file.write('hru_lon =\n')
+        cdl_file.write('  ' + str('%.6f' % hru_lon_vals[0]))
+        for ii in xrange(1, nhrus):
+            cdl_file.write(', ' + str('%.6f' % hru_lon_vals[ii]))
+        cdl_file.write(';\n\n')
 
 # latitude
-    cdl_file.write('seg_lat =\n')
-    cdl_file.write('  ' + str('%.6f' % seg_lat_vals[0]))
-    for ii in xrange(1, nsegments):
-        cdl_file.write(', ' + str('%.6f' % seg_lat_vals[ii]))
-    cdl_file.write(';\n\n')
+        cdl_file.write('seg_lat =\n')
+        cdl_file.write('  ' + str('%.6f' % seg_lat_vals[0]))
+        for ii in xrange(1, nsegments):
+            cdl_file.write(', ' + str('%.6f' % seg_lat_vals[ii]))
+        cdl_file.write(';\n\n')
 
 # longitude
-    cdl_file.write('seg_lon =\n')
-    cdl_file.write('  ' + str('%.6f' % seg_lon_vals[0]))
-    for ii in xrange(1, nsegments):
-        cdl_file.write(', ' + str('%.6f' % seg_lon_vals[ii]))
-    cdl_file.write(';\n\n')
-
-# soil_moist
-    cdl_file.write('soil_moist =\n')
-    for ii in xrange(0, nts):
-        cdl_file.write('  ' + str('%.1f' % soil_moist_vals[ii][0]))
-        for jj in xrange(1, nhrus):
-            cdl_file.write(', ' + str('%.1f' % soil_moist_vals[ii][jj]))
-        if ii == nts-1:
-            cdl_file.write('\n')
-        else:
-            cdl_file.write(',\n')
-    cdl_file.write(';\n\n')
-
-# runoff
-    cdl_file.write('lateral_flow =\n')
-    for ii in xrange(0, nts):
-        cdl_file.write('  ' + str('%.1f' % runoff_vals[ii][0]))
-        for jj in xrange(1, nhrus):
-            cdl_file.write(', ' + str('%.1f' % runoff_vals[ii][jj]))
-        if ii == nts - 1:
-            cdl_file.write('\n')
-        else:
-            cdl_file.write(',\n')
-    cdl_file.write(';\n\n')
-
-# stream_flow
-    cdl_file.write('stream_flow =\n')
-    for ii in xrange(0, nts):
-        cdl_file.write('  ' + str('%.1f' % seg_outflow_vals[ii][0]))
-        for jj in xrange(1, nsegments):
-            cdl_file.write(', ' + str('%.1f' % seg_outflow_vals[ii][jj]))
-        if ii == nts - 1:
-            cdl_file.write('\n')
-        else:
-            cdl_file.write(',\n')
-    cdl_file.write(';\n\n')
-
-    # Close the cdl file
-    cdl_file.write('}\n')
-    cdl_file.close()
+        cdl_file.write('seg_lon =\n')
+        cdl_file.write('  ' + str('%.6f' % seg_lon_vals[0]))
+        for ii in xrange(1, nsegments):
+            cdl_file.write(', ' + str('%.6f' % seg_lon_vals[ii]))
+        cdl_file.write(';\n\n')
+
+        cdl_writer.write_timeseries_values(cdl_file, 'soil_moist', soil_moist_vals)
+        cdl_writer.write_timeseries_values(cdl_file, 'lateral_flow', runoff_vals)
+        cdl_writer.write_timeseries_values(cdl_file, 'streamflow', seg_outflow_vals)
+
+        # Close the cdl file
+        cdl_file.write('}\n')
+        cdl_file.close()
 
 
 if __name__ == '__main__':
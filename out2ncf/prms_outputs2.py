@@ -2,6 +2,7 @@
 # Wed Apr 09 09:43:53 MDT 2019
 
 from prms_utils import csv_reader
+from prms_utils import ncf_writer
 import numpy as np
 import csv
 import json
@@ -110,126 +111,147 @@ def main():
         seg_lon_vals = read_feature_georef(cntl, "seg_lon")
         nsegments = len(seg_lat_vals)
 
-# write the cdl file
-    print 'writing cdl file ' + cntl['cdl_file_name']
-    cdl_file = open(cntl['cdl_file_name'], 'w')
-    cdl_file.write('netcdf ' + cntl["nc_name"] + ' {' + '\n')
-
-    # Write dimensions block
-    cdl_file.write('dimensions:\n')
-    cdl_file.write('  ' + 'time' + ' = ' + str(nts) + ';\n')
+# write the ncf file. This goes to cdl_ncf_file_name (by default nc_name.nc next to the control file), not to
+# ncf_file_name: that one is the file of prms_outputs2_ncf, which it may be adding to every day (ncf_append), and this
+# script would write over it.
+    ncf_name = cntl.get('cdl_ncf_file_name', dir + '/' + cntl['nc_name'] + '.nc')
+    if ncf_name == cntl.get('ncf_file_name'):
+        raise ValueError('netcdf file ' + ncf_name + ' is the ncf_file_name of prms_outputs2_ncf.py')
 
+    print 'writing netcdf file ' + ncf_name
+    georef_vals = {}
     if nhrus > 0:
-        cdl_file.write('  ' + 'hruid' + ' = ' + str(nhrus) + ';\n')
+        georef_vals["hru_lat"] = hru_lat_vals
+        georef_vals["hru_lon"] = hru_lon_vals
 
     if nsegments > 0:
-        cdl_file.write('  ' + 'segid' + ' = ' + str(nsegments) + ';\n')
+        georef_vals["seg_lat"] = seg_lat_vals
+        georef_vals["seg_lon"] = seg_lon_vals
 
-    # Write the variables block
-    cdl_file.write('variables:\n')
+    ncf_writer.write_cntl(ncf_name, cntl, base_date, var_names, val_list, georef_vals, 'prms_outputs2.py')
 
-    # Put in the indexes for the dimensions
-    key = 'time'
-    idname = key + 'id'
-    cdl_file.write('  int time(time);\n')
-    cdl_file.write('    time:long_name = "time";\n')
-    cdl_file.write('    time:standard_name = "time";\n')
-    cdl_file.write('    time:cf_role = "timeseries_id";\n')
-    cdl_file.write('    time:units = "days since ' + base_date +' 00:00' + cntl["tz_code"] + '";\n')
+# write the cdl file, if the control file names one. ncgen makes the same netcdf file from it.
+    if 'cdl_file_name' in cntl:
+        print 'writing cdl file ' + cntl['cdl_file_name']
+        cdl_file = open(cntl['cdl_file_name'], 'w')
+        cdl_file.write('netcdf ' + cntl["nc_name"] + ' {' + '\n')
 
-    if nhrus > 0:
-        key = 'hru'
-        idname = key + 'id'
-        cdl_file.write('  int ' + idname + '(' + idname + ');\n')
-        cdl_file.write('    ' + idname + ':long_name = "local model ' + key + ' id";\n')
+        # Write dimensions block
+        cdl_file.write('dimensions:\n')
+        cdl_file.write('  ' + 'time' + ' = ' + str(nts) + ';\n')
 
-    if nsegments > 0:
-        key = 'seg'
-        idname = key + 'id'
-        cdl_file.write('  int ' + idname + '(' + idname + ');\n')
-        cdl_file.write('    ' + idname + ':long_name = "local model ' + key + ' id";\n')
+        if nhrus > 0:
+            cdl_file.write('  ' + 'hruid' + ' = ' + str(nhrus) + ';\n')
 
-    if nhrus > 0:
-        write_variable_block(cntl, cdl_file, "hru_lat")
-        write_variable_block(cntl, cdl_file, "hru_lon")
+        if nsegments > 0:
+            cdl_file.write('  ' + 'segid' + ' = ' + str(nsegments) + ';\n')
 
-    if nsegments > 0:
-        write_variable_block(cntl, cdl_file, "seg_lat")
-        write_variable_block(cntl, cdl_file, "seg_lon")
+        # Write the variables block
+        cdl_file.write('variables:\n')
 
-    for var_name in var_names:
-        write_timeseries_block(cntl, cdl_file, var_name)
-
-    cdl_file.write('  // global attributes:\n')
-    cdl_file.write('  :Conventions = "CF-1.8";\n')
-    cdl_file.write('  :featureType = "timeSeries";\n')
-    cdl_file.write('  :history = "' + str(datetime.datetime.now()) + ',' + str(getpass.getuser()) + ',prms_outputs2.py";\n')
-
-    # Write data
-    cdl_file.write('\ndata:\n\n')
+        # Put in the indexes for the dimensions
+        key = 'time'
+        idname = key + 'id'
+        cdl_file.write('  int time(time);\n')
+        cdl_file.write('    time:long_name = "time";\n')
+        cdl_file.write('    time:standard_name = "time";\n')
+        cdl_file.write('    time:units = "days since ' + base_date +' 00:00' + cntl["tz_code"] + '";\n')
+
+        if nhrus > 0:
+            key = 'hru'
+            idname = key + 'id'
+            cdl_file.write('  int ' + idname + '(' + idname + ');\n')
+            cdl_file.write('    ' + idname + ':cf_role = "timeseries_id";\n')
+            cdl_file.write('    ' + idname + ':long_name = "local model ' + key + ' id";\n')
+
+        if nsegments > 0:
+            key = 'seg'
+            idname = key + 'id'
+            cdl_file.write('  int ' + idname + '(' + idname + ');\n')
+            cdl_file.write('    ' + idname + ':cf_role = "timeseries_id";\n')
+            cdl_file.write('    ' + idname + ':long_name = "local model ' + key + ' id";\n')
+
+        if nhrus > 0:
+            write_variable_block(cntl, cdl_file, "hru_lat")
+            write_variable_block(cntl, cdl_file, "hru_lon")
+
+        if nsegments > 0:
+            write_variable_block(cntl, cdl_file, "seg_lat")
+            write_variable_block(cntl, cdl_file, "seg_lon")
+
+        for var_name in var_names:
+            write_timeseries_block(cntl, cdl_file, var_name)
+
+        cdl_file.write('  // global attributes:\n')
+        cdl_file.write('  :Conventions = "CF-1.8";\n')
+        cdl_file.write('  :featureType = "timeSeries";\n')
+        cdl_file.write('  :history = "' + str(datetime.datetime.now()) + ',' + str(getpass.getuser()) + ',prms_outputs2.py";\n')
+
+        # Write data
+        cdl_file.write('\ndata:\n\n')
 
 # time
-    cdl_file.write('time =\n')
-    cdl_file.write('  0')
-    for ii in xrange(1, nts):
-        cdl_file.write(', ' + str(ii))
-    cdl_file.write(';\n\n')
-
-    if nhrus > 0:
-# hruid
-        cdl_file.write('hruid =\n')
-        cdl_file.write('  1')
-        for ii in xrange(2, nhrus):
+        cdl_file.write('time =\n')
+        cdl_file.write('  0')
+        for ii in xrange(1, nts):
             cdl_file.write(', ' + str(ii))
         cdl_file.write(';\n\n')
 
-    if nsegments > 0:
+        if nhrus > 0:
+# hruid
+            cdl_file.write('hruid =\n')
+            cdl_file.write('  1')
+            for ii in xrange(2, nhrus + 1):
+                cdl_file.write(', ' + str(ii))
+            cdl_file.write(';\n\n')
+
+        if nsegments > 0:
 # segid
-        cdl_file.write('segid =\n')
-        cdl_file.write('  1')
-        for ii in xrange(2, nsegments):
-            cdl_file.write(', ' + str(ii))
-        cdl_file.write(';\n\n')
+            cdl_file.write('segid =\n')
+            cdl_file.write('  1')
+            for ii in xrange(2, nsegments + 1):
+                cdl_file.write(', ' + str(ii))
+            cdl_file.write(';\n\n')
 
-    if nhrus > 0:
+        if nhrus > 0:
 # latitude
-        cdl_file.write('hru_lat =\n')
-        cdl_file.write('  ' + str('%.6f' % hru_lat_vals[0]))
-        for ii in xrange(1, nhrus):
-            cdl_file.write(', ' + str('%.6f' % hru_lat_vals[ii]))
-        cdl_file.write(';\n\n')
+            cdl_file.write('hru_lat =\n')
+            cdl_file.write('  ' + str('%.6f' % hru_lat_vals[0]))
+            for ii in xrange(1, nhrus):
+                cdl_file.write(', ' + str('%.6f' % hru_lat_vals[ii]))
+            cdl_file.write(';\n\n')
 
 # longitude
-        cdl_file.write('hru_lon =\n')
-        cdl_file.write('  ' + str('%.6f' % hru_lon_vals[0]))
-        for ii in xrange(1, nhrus):
-            cdl_file.write(', ' + str('%.6f' % hru_lon_vals[ii]))
-        cdl_file.write(';\n\n')
+            cdl_file.write('hru_lon =\n')
+            cdl_file.write('  ' + str('%.6f' % hru_lon_vals[0]))
+            for ii in xrange(1, nhrus):
+                cdl_file.write(', ' + str('%.6f' % hru_lon_vals[ii]))
+            cdl_file.write(';\n\n')
 
-    if nsegments > 0:
+        if nsegments > 0:
 # latitude
-        cdl_file.write('seg_lat =\n')
-        cdl_file.write('  ' + str('%.6f' % seg_lat_vals[0]))
-        for ii in xrange(1, nsegments):
-            cdl_file.write(', ' + str('%.6f' % seg_lat_vals[ii]))
-        cdl_file.write(';\n\n')
+            cdl_file.write('seg_lat =\n')
+            cdl_file.write('  ' + str('%.6f' % seg_lat_vals[0]))
+            for ii in xrange(1, nsegments):
+                cdl_file.write(', ' + str('%.6f' % seg_lat_vals[ii]))
+            cdl_file.write(';\n\n')
 
 # longitude
-        cdl_file.write('seg_lon =\n')
-        cdl_file.write('  ' + str('%.6f' % seg_lon_vals[0]))
-        for ii in xrange(1, nsegments):
-            cdl_file.write(', ' + str('%.6f' % seg_lon_vals[ii]))
-        cdl_file.write(';\n\n')
+            cdl_file.write('seg_lon =\n')
+            cdl_file.write('  ' + str('%.6f' % seg_lon_vals[0]))
+            for ii in xrange(1, nsegments):
+                cdl_file.write(', ' + str('%.6f' % seg_lon_vals[ii]))
+            cdl_file.write(';\n\n')
 
-    ii = 0
-    for var_name in var_names:
-        vals = val_list[ii]
-        write_timeseries_values(cntl, cdl_file, var_name, vals)
-        ii = ii + 1
+        ii = 0
+        for var_name in var_names:
+            vals = val_list[ii]
+            write_timeseries_values(cntl, cdl_file, var_name, vals)
+            ii = ii + 1
 
-    # Close the cdl file
-    cdl_file.write('}\n')
-    cdl_file.close()
+        # Close the cdl file
+        cdl_file.write('}\n')
+        cdl_file.close()
 
 
 if __name__ == '__main__':
@@ -2,12 +2,11 @@
 # Wed Apr 09 09:43:53 MDT 2019
 
 from prms_utils import csv_reader
+from prms_utils import ncf_writer
 import numpy as np
 import csv
 import json
-import datetime
-import getpass
-from netCDF4 import Dataset
+import os
 
 dir = "/work/markstro/operat/docker_test/NHM-PRMS_CONUS"
 json_file = dir + "/" + "variable_info.json"
@@ -28,131 +27,96 @@ def read_feature_georef(cntl, name):
     return vals
 
 
-def write_variable_block(cntl, ncf, name):
-    v1 = ncf.createVariable(name, np.float64, (cntl["feature_georef"][name]["dimid"]),
-                            fill_value=float(cntl["feature_georef"][name]["fill_value"]))
-    v1.long_name = cntl["feature_georef"][name]["long_name"]
-    v1.standard_name = cntl["feature_georef"][name]["standard_name"]
-    v1.units = cntl["feature_georef"][name]["units"]
-    return v1
-
-
-def write_timeseries_block(cntl, ncf, name):
-    v1 = ncf.createVariable(name, np.float64, ("time", cntl["output_variables"][name]["georef"]["dimid"]),
-                            fill_value=float(cntl["output_variables"][name]["fill_value"]))
-    v1.long_name = cntl["output_variables"][name]["long_name"]
-    v1.standard_name = cntl["output_variables"][name]["standard_name"]
-    v1.units = cntl["output_variables"][name]["out_units"]
-    return v1
+# Read the PRMS output of every variable and convert it to the output units. Returns the base date and the list of
+# values.
+def read_outputs(cntl, var_names):
+    val_list = []
+    for var_name in var_names:
+        print "processing " + var_name
 
+        csv_fn = cntl["output_variables"][var_name]["prms_out_file"]
+        nts, nfeats, base_date, vals = csv_reader.read_output(csv_fn)
 
-def write_timeseries_values(cntl, ncf, name, vals, nc_var):
-    for ii in xrange(0, len(vals)):
-        nc_var[ii, :] = vals[ii]
+        conversion_factor = float(cntl["output_variables"][var_name]["conversion_factor"])
+        val_list.append(vals * conversion_factor)
+    return base_date, val_list
+
+
+# Add the time steps of the csv files that are not in the netcdf file yet onto the end of it. The file has to have
+# been written from the same csv files (same base date, features and variables). Only the csv lines after the last
+# day in the file are read, so a daily update only costs the new day.
+def append_ncf(cntl, var_names, dims):
+    ncf_name = cntl['ncf_file_name']
+    base_date = csv_reader.output_base_date(cntl["output_variables"][var_names[0]]["prms_out_file"])
+    timeseries = [(var_name, ncf_writer.timeseries_attrs(cntl, var_name)) for var_name in var_names]
+    ncf = ncf_writer.open_append(ncf_name, base_date, cntl["tz_code"], dims, timeseries)
+
+    try:
+        start = ncf_writer.next_date(ncf)
+        print 'appending to netcdf file ' + ncf_name + ' from ' + start
+
+        # Read and check every csv file before anything is written, so that a bad one leaves the file as it was
+        # (and the days get appended on the next run, instead of being skipped for good)
+        new_vals = []
+        new_nts = None
+        for var_name in var_names:
+            csv_fn = cntl["output_variables"][var_name]["prms_out_file"]
+            if csv_reader.output_base_date(csv_fn) != base_date:
+                raise ValueError('base date of ' + csv_fn + ' is not ' + base_date)
+            ncf_writer.check_feature_ids(ncf, var_name, csv_reader.output_feature_ids(csv_fn))
+
+            nts, nfeats, first_date, vals = csv_reader.read_output_tail(csv_fn, start)
+            if nts > 0 and first_date != start:
+                raise ValueError(csv_fn + ' goes from ' + first_date + ', not from ' + start)
+            if new_nts is not None and nts != new_nts:
+                raise ValueError('number of new timesteps not the same in all of the csv files')
+            new_nts = nts
+
+            ncf_writer.check_append(ncf, var_name, vals)
+
+            conversion_factor = float(cntl["output_variables"][var_name]["conversion_factor"])
+            new_vals.append((var_name, vals * conversion_factor))
+
+        if new_nts == 0:
+            print 'nothing to append'
+        else:
+            ncf_writer.append(ncf, new_vals)
+            print 'appended ' + str(new_nts) + ' time steps'
+    finally:
+        ncf.close()
 
 
 def main():
     with open(json_file, "r") as read_file:
         cntl = json.load(read_file)
 
-# Read the PRMS output
     var_names = cntl["output_variables"].keys()
-    val_list = []
     dim_list = set()
-
     for var_name in var_names:
-        print "processing " + var_name
         dim_list.add(cntl["output_variables"][var_name]["georef"]["dimid"])
 
-        csv_fn = cntl["output_variables"][var_name]["prms_out_file"]
-        nts, nfeats, base_date, vals = csv_reader.read_output(csv_fn)
-
-        conversion_factor = float(cntl["output_variables"][var_name]["conversion_factor"])
-        iis = len(vals)
-        jjs = len(vals[0])
-
-        for ii in xrange(0, iis):
-            for jj in xrange(1, jjs):
-                vals[ii,jj] = vals[ii,jj] * conversion_factor
-
-        val_list.append(vals)
-
-    nhrus = -1
+    georef_vals = {}
     if 'hruid' in dim_list:
-        hru_lat_vals = read_feature_georef(cntl, "hru_lat")
-        hru_lon_vals = read_feature_georef(cntl, "hru_lon")
-        nhrus = len(hru_lat_vals)
-
+        georef_vals["hru_lat"] = read_feature_georef(cntl, "hru_lat")
+        georef_vals["hru_lon"] = read_feature_georef(cntl, "hru_lon")
 
-    nsegments = -1
     if 'segid' in dim_list:
-        seg_lat_vals = read_feature_georef(cntl, "seg_lat")
-        seg_lon_vals = read_feature_georef(cntl, "seg_lon")
-        nsegments = len(seg_lat_vals)
-
-# write the ncf file
-    print 'writing netcdf file ' + cntl['ncf_file_name']
-    ncf = Dataset(cntl['ncf_file_name'], 'w', format='NETCDF4_CLASSIC')
-
-    # Write dimensions block
-    if nhrus > 0:
-        hru_dim = ncf.createDimension('hruid', nhrus)
-    if nsegments > 0:
-        nsegments_dim = ncf.createDimension('segid', nsegments)
-    time_dim = ncf.createDimension('time', None)
-
-    # Put in the indexes for the dimensions
-    time_idx = ncf.createVariable("time", np.int32, ("time"), )
-    time_idx.long_name = "time"
-    time_idx.standard_name = "time"
-    time_idx.cf_role = "timeseries_id"
-    time_idx.units = "days since " + base_date + " 00:00" + cntl["tz_code"]
-
-    if nhrus > 0:
-        hru_idx = ncf.createVariable("hruid", np.int32, ("hruid"), )
-        hru_idx.long_name = "local model hru id"
-
-    if nsegments > 0:
-        seg_idx = ncf.createVariable("segid", np.int32, ("segid"), )
-        seg_idx.long_name = "local model seg id"
-
-    if nhrus > 0:
-        hru_lat = write_variable_block(cntl, ncf, "hru_lat")
-        hru_lon = write_variable_block(cntl, ncf, "hru_lon")
-
-    if nsegments > 0:
-        seg_lat = write_variable_block(cntl, ncf, "seg_lat")
-        seg_lon = write_variable_block(cntl, ncf, "seg_lon")
-
-    ncf_vars = []
-    for var_name in var_names:
-        ncf_vars.append(write_timeseries_block(cntl, ncf, var_name))
+        georef_vals["seg_lat"] = read_feature_georef(cntl, "seg_lat")
+        georef_vals["seg_lon"] = read_feature_georef(cntl, "seg_lon")
 
-    ncf.conventions = "CF-1.8"
-    ncf.featureType = "timeSeries"
-    ncf.history = str(datetime.datetime.now()) + ',' + str(getpass.getuser()) + ',prms_outputs2.py'
+# With "ncf_append": true in the control file, an existing file is added to instead of written again
+    if cntl.get("ncf_append", False) and os.path.exists(cntl['ncf_file_name']):
+        dims, georefs = ncf_writer.cntl_layout(cntl, georef_vals)
+        append_ncf(cntl, var_names, dims)
+        return
 
-    # Write data
-    time_idx[:] = np.arange(0, nts, 1)
-    if nhrus > 0:
-        hru_idx[:] = np.arange(1, nhrus+1, 1)
-    if nsegments > 0:
-        seg_idx[:] = np.arange(1, nsegments + 1, 1)
-
-    if nhrus > 0:
-        hru_lat[:] = hru_lat_vals
-        hru_lon[:] = hru_lon_vals
-
-    if nsegments > 0:
-        seg_lat[:] = seg_lat_vals
-        seg_lon[:] = seg_lon_vals
-
-    ii = 0
-    for var_name in var_names:
-        write_timeseries_values(cntl, ncf, var_name, val_list[ii], ncf_vars[ii])
-        ii = ii + 1
+# Read the PRMS output
+    base_date, val_list = read_outputs(cntl, var_names)
 
-    ncf.close()
+# write the ncf file
+    print 'writing netcdf file ' + cntl['ncf_file_name']
+    ncf_writer.write_cntl(cntl['ncf_file_name'], cntl, base_date, var_names, val_list, georef_vals,
+                          'prms_outputs2.py', appendable=cntl.get("ncf_append", False))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,106 @@
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
+from prms_utils import csv_reader
+from prms_utils import paramfile
+from prms_utils import topology
+
+# Sum HRU values into the segments that they drain to, and accumulate segment values down the network.
+#
+# Two sparse operators are built once from the topology (see topology.py):
+#   hru_to_seg - (nsegment, nhru); row s has the HRUs that flow straight into segment s + 1, weighted by hru_area
+#                (or 1 without areas)
+#   network    - I - A, where A is the one link adjacency from tosegment (one entry per segment that isn't an outlet),
+#                with the segments in the order of the topology tour. Every segment comes before the segments
+#                upstream of it in the tour, so this is upper triangular, and the accumulated totals x of segment
+#                values b are the solution of network x = b: each segment's own value plus the totals of the
+#                segments that flow straight into it.
+# A (nts, nhru) block of HRU values then goes to (nts, nsegment) basin totals with a sparse multiply and one sparse
+# triangular solve for all of the time steps. Both cost about one operation per segment (or HRU) per time step.
+
+
+# Sparse LU of the (nsegment, nsegment) network matrix, in tour order. The matrix is already triangular with a unit
+# diagonal, so it is factored in its own order without pivoting and there is no fill in.
+def _network_solver(topo):
+    nseg = topo.nsegment
+    tosegment = np.asarray(topo.tosegment)
+    first = np.asarray(topo.first)
+
+    child = np.nonzero(tosegment > 0)[0]
+    rows = np.concatenate((np.arange(nseg), first[tosegment[child] - 1]))
+    cols = np.concatenate((np.arange(nseg), first[child]))
+    data = np.concatenate((np.ones(nseg), -np.ones(len(child))))
+    network = scipy.sparse.csc_matrix((data, (rows, cols)), shape=(nseg, nseg))
+
+    return scipy.sparse.linalg.splu(network, permc_spec='NATURAL', diag_pivot_thresh=0.0,
+                                    options={'SymmetricMode': True})
+
+
+# (nsegment, nhru) matrix of the weight of each HRU in the segment that it flows into
+def _hru_matrix(topo, hru_area=None):
+    hru_segment = np.asarray(topo.hru_segment)
+    connected = np.nonzero(hru_segment > 0)[0]
+
+    if hru_area is None:
+        data = np.ones(len(connected))
+    else:
+        data = np.asarray(hru_area, dtype=float)[connected]
+
+    return scipy.sparse.csr_matrix((data, (hru_segment[connected] - 1, connected)),
+                                   shape=(topo.nsegment, topo.nhru))
+
+
+class Accumulator(object):
+    # topo is a topology.Topology. With hru_area, the HRU values are multiplied by the area of the HRU as they go into
+    # the segments (depths to volumes).
+    def __init__(self, topo, hru_area=None):
+        self.topo = topo
+        self.hru_to_seg = _hru_matrix(topo, hru_area)
+        self.tour = np.asarray(topo.tour)
+        self.network = _network_solver(topo)
+
+    # (nts, nhru) HRU values to (nts, nsegment) totals of the HRUs that flow straight into each segment
+    def segment_sums(self, block):
+        block = np.asarray(block, dtype=float).reshape(-1, self.topo.nhru)
+        return np.ascontiguousarray(self.hru_to_seg.dot(block.T).T)
+
+    # (nts, nsegment) segment values to (nts, nsegment) totals over each segment and everything upstream of it
+    def accumulate(self, block):
+        block = np.asarray(block, dtype=float).reshape(-1, self.topo.nsegment)
+        if len(block) == 0:
+            return block.copy()
+
+        # solve in tour order (one column per time step) and put the segments back in their own order
+        totals = self.network.solve(np.asfortranarray(block[:, self.tour].T))
+        out = np.empty_like(block)
+        out[:, self.tour] = totals.T
+        return out
+
+    # (nts, nhru) HRU values to (nts, nsegment) totals over all of the HRUs upstream of each segment
+    def basin_sums(self, block):
+        return self.accumulate(self.segment_sums(block))
+
+    # Basin totals of an nhru output csv (eg nhru_hru_lateral_flow.csv), a chunk of time steps at a time. Yields
+    # (dates, (nts, nsegment) totals) for each chunk.
+    def iter_basin_sums(self, csvfn, chunk_size=365, start=None, end=None):
+        for dates, vals in csv_reader.iter_output(csvfn, chunk_size, start=start, end=end):
+            yield dates, self.basin_sums(vals)
+
+
+# Build the accumulator for the parameter file pfn, with the HRU values weighted by hru_area if area is True.
+# The parameter file is read lazily, and only once, for both the topology and hru_area.
+def read(pfn, area=False):
+    pf = None
+    hru_area = None
+    if area:
+        pf = paramfile.ParamFile()
+        pf.read(pfn, lazy=True)
+        hru_area = pf.params['hru_area'].vals
+
+    return Accumulator(topology.read(pfn, pf), hru_area)
+
+
+if __name__ == '__main__':
+    acc = read('/work/markstro/operat/setup/test/NHM-PRMS_CONUS/input/myparam.param', area=True)
+    for dates, vals in acc.iter_basin_sums('/work/markstro/operat/setup/test/NHM-PRMS_CONUS/output/nhru_hru_lateral_flow.csv'):
+        print dates[0], dates[-1], vals.shape
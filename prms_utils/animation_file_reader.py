@@ -1,97 +1,168 @@
 import numpy as np
 import os
+import re
+import itertools
+import json
+from prms_utils import date_index
 
-fn = '/ssd/markstro/conusStreamTemp/work_lev3/out/stream_temp.out.nsegment'
+# Reader for PRMS animation files (eg stream_temp.out.nsegment). The file starts with '#' comment lines, then a line
+# of column names (timestamp, feature dimension and then the variables), then a line of column formats. Each data
+# line is the date (YYYY-MM-DD), the (one based) feature index and the values of the variables, with all of the
+# features for a day before the next day.
 
+# Number of lines to parse at a time
+chunk_size = 100000
 
-def sizes():
-    num_lines = sum(1 for line in open(fn))
-    print num_lines
-
-    ii = 0
-    with open(fn) as fp:
-        line = fp.readline()
-        ii = ii + 1
-
-        while line.startswith('#'):
-            line = fp.readline()
-            ii = ii + 1
-
-        col_names = line.split()
-        line = fp.readline()
-        ii = ii + 1
-        line = fp.readline()
-        ii = ii + 1
-    toks = line.split()
-    first_date = toks[0]
-
-    header_len = ii
-
-    with open(fn, "rb") as f:
-        first = f.readline()        # Read the first line.
-        f.seek(-2, os.SEEK_END)     # Jump to the second last byte.
-        while f.read(1) != b"\n":   # Until EOL is found...
-            f.seek(-2, os.SEEK_CUR) # ...jump back the read byte plus one more.
-        last = f.readline()         # Read last line.
-
-    toks = last.split()
-    last_date = toks[0]
-    nfeats = int(toks[1])
-    nts = ((num_lines - header_len) / nfeats) + 1
-
-    return first_date, last_date, nfeats, nts, col_names
+_date_at_line_start = re.compile(r'^(\s*\d+)-(\d+)-(\d+)', re.MULTILINE)
 
 
-def read_vals(first_date, last_date, nfeats, nts, col_names):
-# allocate the arrays
-    dates = np.chararray(nts)
-    val_list =[]
-    for ii in xrange(len(col_names) - 2):
-        val_list.append(np.zeros([nts, nfeats]))
-
-    with open(fn) as fp:
-        line = fp.readline()
-
-        while line.startswith('#'):
-            line = fp.readline()
-
-        line = fp.readline()
+# Read up to the first data line. Returns the column names.
+def _read_header(fp):
+    line = fp.readline()
+    while line.startswith('#'):
         line = fp.readline()
 
-        ii = -1
-        date_string = None
-        while line:
-            # print("Line {}: {}".format(cnt, line.strip()))
-            toks = line.split()
-            # print("    toks " , toks)
-
-# Check to see if the date stamp has incremented
-            if date_string != toks[0]:
-                ii += 1
-                print date_string, str(ii)
-                dates[ii] = toks[0]
-                date_string = toks[0]
-
-            jj = int(toks[1]) - 1
-            for kk in xrange(len(col_names) - 2):
-                vals = val_list[kk]
-# ii is the time step, jj is the feature index, kk is the variable
-                vals[ii,jj] = float(toks[2+kk])
-
-            line = fp.readline()
-
-    return val_list
+    col_names = line.split()
+
+    # column format line
+    fp.readline()
+    return col_names
+
+
+# The last (non blank) line of the file
+def _last_line(fn):
+    with open(fn, 'rb') as fp:
+        fp.seek(0, os.SEEK_END)
+        size = fp.tell()
+        back = 1024
+        while True:
+            fp.seek(max(0, size - back))
+            lines = [line for line in fp.read().splitlines() if line.strip()]
+            if len(lines) > 1 or back >= size:
+                return lines[-1]
+            back *= 2
+
+
+# Parse a chunk of data lines into a (nlines, 3 + 1 + nvars) array: year, month, day, feature index, values.
+def _parse_lines(lines, ncol, fn):
+    text = _date_at_line_start.sub(r'\1 \2 \3', ''.join(lines))
+    nlines = sum(1 for line in lines if line.strip())
+    vals = np.fromstring(text, dtype=float, sep=' ')
+    if vals.size != nlines * ncol:
+        raise ValueError('could not parse the values in ' + fn)
+    return vals.reshape(nlines, ncol)
+
+
+# Iterate over the data lines of an animation file a chunk at a time. Yields (time step index, feature index (zero
+# based), values of the columns in cols) for each chunk. Time step index 0 is the date of the first line.
+def _iter_chunks(fp, first_date, ncol, cols, fn):
+    while True:
+        lines = list(itertools.islice(fp, chunk_size))
+        if not lines:
+            return
+
+        block = _parse_lines(lines, ncol, fn)
+        ts = (date_index.to_datetime64(block[:, :3]) - first_date).astype(int)
+        feat = block[:, 3].astype(int) - 1
+        yield ts, feat, block[:, 4 + cols]
+
+
+# Read an animation file in one pass. Returns
+#   dates - datetime64[D] array (nts) of the dates
+#   var_names - names of the variables in vals
+#   vals - float32 array (nvars, nts, nfeats); vals[kk, ii, jj] is variable kk on day ii for feature jj + 1
+#
+# var_names is an optional list of the variables to read. Only those are kept, in that order.
+def read(fn, var_names=None):
+    dates, names, cols, nfeats = sizes(fn, var_names)
+    vals = np.empty(shape=(len(names), len(dates), nfeats), dtype=np.float32)
+    vals.fill(np.nan)
+
+    with open(fn, 'rb') as fp:
+        col_names = _read_header(fp)
+        for ts, feat, block in _iter_chunks(fp, dates[0], len(col_names) + 2, cols, fn):
+            vals[:, ts, feat] = block.T
+
+    return dates, names, vals
+
+
+# Figure out the dates and the number of features from the header, the first and the last lines of the file. Returns
+# the dates, the names of the variables that were asked for (all of them if var_names is None), the column of each of
+# those in the values and the number of features.
+def sizes(fn, var_names=None):
+    with open(fn, 'rb') as fp:
+        col_names = _read_header(fp)
+        first = fp.readline()
+
+    last = _last_line(fn)
+
+    all_names = col_names[2:]
+    if var_names is None:
+        var_names = all_names
+    try:
+        cols = np.array([all_names.index(name) for name in var_names], dtype=int)
+    except ValueError:
+        raise ValueError('not all of ' + str(var_names) + ' are in ' + fn)
+
+    first_date = np.datetime64(first.split()[0], 'D')
+    last_date = np.datetime64(last.split()[0], 'D')
+    nfeats = int(last.split()[1])
+    dates = np.arange(first_date, last_date + 1)
+
+    return dates, list(var_names), cols, nfeats
+
+
+# Write each variable of an animation file to out_dir as <variable>.npy, a (nts, nfeats) float32 array in numpy's
+# binary format, with <variable>.json next to it holding the shape, dtype, dates and feature ids. read_export opens
+# these without parsing any text. The .npy files are memory mapped and filled a chunk at a time, so the whole file is
+# never in memory.
+def export(fn, out_dir, var_names=None):
+    dates, names, cols, nfeats = sizes(fn, var_names)
+    shape = (len(dates), nfeats)
+
+    outs = []
+    for name in names:
+        vals = np.lib.format.open_memmap(os.path.join(out_dir, name + '.npy'), mode='w+', dtype='f4', shape=shape)
+        vals.fill(np.nan)
+        outs.append(vals)
+
+    with open(fn, 'rb') as fp:
+        col_names = _read_header(fp)
+        for ts, feat, block in _iter_chunks(fp, dates[0], len(col_names) + 2, cols, fn):
+            for kk in xrange(len(outs)):
+                outs[kk][ts, feat] = block[:, kk]
+
+    feature_ids = range(1, nfeats + 1)
+    for kk in xrange(len(names)):
+        outs[kk].flush()
+        base = os.path.join(out_dir, names[kk])
+        header = {'var_name': names[kk], 'shape': list(shape), 'dtype': str(outs[kk].dtype),
+                  'dates': [str(d) for d in dates], 'feature_ids': feature_ids}
+        with open(base + '.json', 'w') as fp:
+            json.dump(header, fp)
+
+    return names
+
+
+# Open a variable written by export. Returns the dates (datetime64[D]), the feature ids and the (nts, nfeats) values,
+# memory mapped read only from the .npy file.
+def read_export(out_dir, var_name):
+    base = os.path.join(out_dir, var_name)
+    with open(base + '.json') as fp:
+        header = json.load(fp)
+
+    vals = np.load(base + '.npy', mmap_mode='r')
+    if list(vals.shape) != header['shape']:
+        raise ValueError('shape of ' + base + '.npy does not match ' + base + '.json')
+
+    dates = np.array(header['dates'], dtype='datetime64[D]')
+    feature_ids = np.array(header['feature_ids'], dtype=int)
+    return dates, feature_ids, vals
 
 
 if __name__ == '__main__':
-    first_date, last_date, nfeats, nts, col_names = sizes()
-    print first_date, last_date, nfeats, nts, col_names
-    val_list = read_vals(first_date, last_date, nfeats, nts, col_names)
-
+    fn = '/ssd/markstro/conusStreamTemp/work_lev3/out/stream_temp.out.nsegment'
     dir = '/ssd/markstro/conusStreamTemp/work_lev3/out/'
-    for kk in xrange(len(col_names) - 2):
-        vals = val_list[kk]
-        fn1 = dir + col_names[kk+2] + ".txt"
-        np.savetxt(fn1, vals, delimiter=',',fmt='%.4e')
 
-        print vals
+    var_names = export(fn, dir)
+    print var_names
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import contextlib
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Binary sidecar cache for parsed PRMS text files.
+#
+# The arrays that a reader parses out of a file are saved as .npy files, along with a small json file that holds the
+# rest of what the reader returns, in a directory next to the file (.<file name>.cache/<kind>). The next time the file
+# is read, the arrays are memory mapped from there instead of parsing the text again. An entry is only used when the
+# size, the modification time and a hash of the contents of the file still match what they were when it was written.
+#
+# The arrays are mapped copy-on-write, so callers can change them in place without touching the cache.
+
+# The readers only use the cache when this is set. See enable()
+enabled = False
+
+# Limit on the total size (in bytes) of all cache entries. The least recently used entries are removed to stay under it.
+max_bytes = 10 * 1024 ** 3
+
+# Every entry is listed in this file, with its size and when it was last used, so that the size limit can be applied
+# across all of the directories that have cached files in them. Several processes can share it (eg parallel
+# calibration runs), so it is only changed while holding a lock on index_file + '.lock', and it is written to a
+# temporary file that then replaces it, so that it is never seen half written.
+index_file = os.path.join(os.path.expanduser('~'), '.prms_utils_cache.json')
+
+# Number of bytes, from the start and from the end of the file, that go into the content hash
+hash_bytes = 1024 * 1024
+
+
+def enable(limit=None):
+    global enabled, max_bytes
+    enabled = True
+    if limit is not None:
+        max_bytes = limit
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def _cache_dir(fn):
+    head, tail = os.path.split(os.path.abspath(fn))
+    return os.path.join(head, '.' + tail + '.cache')
+
+
+def _entry_dir(fn, kind):
+    return os.path.join(_cache_dir(fn), kind)
+
+
+# The key for a file: path, size, modification time and a hash of the first and last hash_bytes of the contents
+def _signature(fn):
+    st = os.stat(fn)
+    h = hashlib.md5()
+    with open(fn, 'rb') as fp:
+        h.update(fp.read(hash_bytes))
+        if st.st_size > hash_bytes:
+            fp.seek(max(hash_bytes, st.st_size - hash_bytes))
+            h.update(fp.read(hash_bytes))
+
+    return {'path': os.path.abspath(fn), 'size': st.st_size, 'mtime': st.st_mtime, 'hash': h.hexdigest()}
+
+
+# json gives back unicode strings; the readers return plain strings
+def _to_str(obj):
+    if isinstance(obj, unicode):
+        return str(obj)
+    elif isinstance(obj, list):
+        return [_to_str(x) for x in obj]
+    elif isinstance(obj, dict):
+        return dict((_to_str(k), _to_str(v)) for k, v in obj.items())
+    return obj
+
+
+def _read_index():
+    try:
+        with open(index_file, 'r') as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return {}
+
+
+def _write_index(index):
+    tmp = index_file + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(tmp, 'w') as fp:
+            json.dump(index, fp)
+        try:
+            os.rename(tmp, index_file)
+        except OSError:
+            # windows won't rename over a file that is there
+            os.remove(index_file)
+            os.rename(tmp, index_file)
+    except (IOError, OSError):
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+
+# Hold the lock on the index for a read-modify-write of it. If the lock file can't be opened, it goes ahead without.
+@contextlib.contextmanager
+def _index_lock():
+    try:
+        fp = open(index_file + '.lock', 'a+')
+    except IOError:
+        yield
+        return
+
+    try:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX)
+        else:
+            fp.seek(0)
+            msvcrt.locking(fp.fileno(), msvcrt.LK_LOCK, 1)
+        yield
+    finally:
+        if fcntl is not None:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
+        else:
+            fp.seek(0)
+            msvcrt.locking(fp.fileno(), msvcrt.LK_UNLCK, 1)
+        fp.close()
+
+
+def _remove_entry(d):
+    shutil.rmtree(d, ignore_errors=True)
+
+    # get rid of the .<file name>.cache directory too once it is empty
+    try:
+        os.rmdir(os.path.dirname(d))
+    except OSError:
+        pass
+
+
+# Add (or update) an entry in the index, then remove the least recently used entries until everything fits in max_bytes.
+# If the new entry is bigger than max_bytes all by itself, it gets removed too.
+def _register(d, nbytes):
+    with _index_lock():
+        index = _read_index()
+        index[d] = [nbytes, time.time()]
+
+        total = sum(v[0] for v in index.values())
+        for old in sorted(index, key=lambda k: index[k][1]):
+            if total <= max_bytes:
+                break
+            total -= index.pop(old)[0]
+            _remove_entry(old)
+
+        _write_index(index)
+
+
+def _touch(d):
+    with _index_lock():
+        index = _read_index()
+        if d in index:
+            index[d][1] = time.time()
+            _write_index(index)
+
+
+# Look up the cache entry for file fn written by reader kind. Returns (meta, arrays) or None if there is no entry or if
+# the file has changed since the entry was written. meta is the dictionary that was given to store(); arrays is a
+# dictionary of memory mapped arrays.
+def load(fn, kind):
+    d = _entry_dir(fn, kind)
+    try:
+        with open(os.path.join(d, 'meta.json'), 'r') as fp:
+            entry = json.load(fp)
+    except (IOError, ValueError):
+        return None
+
+    if entry['signature'] != _signature(fn):
+        invalidate(fn, kind)
+        return None
+
+    arrays = {}
+    for name in entry['arrays']:
+        afn = os.path.join(d, name + '.npy')
+        try:
+            arrays[str(name)] = np.load(afn, mmap_mode='c')
+        except ValueError:
+            # zero length arrays can't be memory mapped
+            arrays[str(name)] = np.load(afn)
+
+    _touch(d)
+    return _to_str(entry['meta']), arrays
+
+
+# Write a cache entry for file fn. meta is a dictionary of json serializable values; arrays is a dictionary of numpy
+# arrays (not object arrays). If the entry can't be written (read only directory, disk full, ...) there just isn't one.
+def store(fn, kind, meta, arrays):
+    d = _entry_dir(fn, kind)
+    try:
+        if os.path.isdir(d):
+            shutil.rmtree(d)
+        os.makedirs(d)
+
+        nbytes = 0
+        for name in arrays:
+            afn = os.path.join(d, name + '.npy')
+            np.save(afn, arrays[name])
+            nbytes += os.path.getsize(afn)
+
+        entry = {'signature': _signature(fn), 'meta': meta, 'arrays': list(arrays)}
+        with open(os.path.join(d, 'meta.json'), 'w') as fp:
+            json.dump(entry, fp)
+        nbytes += os.path.getsize(os.path.join(d, 'meta.json'))
+
+    except (IOError, OSError):
+        _remove_entry(d)
+        return
+
+    _register(d, nbytes)
+
+
+# Remove the cache entry for file fn written by reader kind, or all of the entries for fn if kind is None.
+def invalidate(fn, kind=None):
+    if kind is None:
+        dirs = []
+        top = _cache_dir(fn)
+        if os.path.isdir(top):
+            dirs = [os.path.join(top, k) for k in os.listdir(top)]
+    else:
+        dirs = [_entry_dir(fn, kind)]
+
+    with _index_lock():
+        index = _read_index()
+        for d in dirs:
+            index.pop(d, None)
+            _remove_entry(d)
+        _write_index(index)
+
+
+# Remove every cache entry
+def clear():
+    with _index_lock():
+        index = _read_index()
+        for d in index:
+            _remove_entry(d)
+        _write_index({})
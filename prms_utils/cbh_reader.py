@@ -0,0 +1,72 @@
+import numpy as np
+from prms_utils import cache
+from prms_utils import date_index
+
+# Reader for PRMS climate-by-HRU (CBH) files, as they come out of the operational runs (ie with the header). The
+# header is a description line, then one "<variable name> <count>" line for each variable in the file, then the
+# "####" line that marks the start of the data. Each data line is the date/time (year month day hour minute second)
+# followed by the values of all of the variables.
+
+
+def _read_header(fp):
+    fp.readline()
+
+    var_names = []
+    var_counts = []
+    line = fp.readline()
+    while line and not line.startswith('#'):
+        split = line.split()
+        if split and not line.startswith('//'):
+            var_names.append(split[0])
+            var_counts.append(int(split[1]))
+        line = fp.readline()
+
+    if not line:
+        raise ValueError('no #### line in ' + fp.name)
+
+    return var_names, var_counts
+
+
+# Read a CBH file. Returns the variable names and counts from the header, the dates (datetime64[D]) and a contiguous
+# (nts, sum of the counts) array of the values. The numeric block is parsed all at once.
+#
+# start and end limit the read to the dates from start to end (inclusive). The date index (see date_index.py) is used
+# to seek straight to start. These reads don't go through the cache.
+def read(cbhfn, start=None, end=None):
+    windowed = start is not None or end is not None
+    if cache.enabled and not windowed:
+        cached = cache.load(cbhfn, 'cbh')
+        if cached is not None:
+            meta, arrays = cached
+            return meta['var_names'], meta['var_counts'], arrays['dates'], arrays['vals']
+
+    with open(cbhfn, 'rb') as fp:
+        var_names, var_counts = _read_header(fp)
+
+        if windowed:
+            row0, row1, begin, stop = date_index.window(cbhfn, fp.tell(), date_index.line_date, start, end)
+            fp.seek(begin)
+            text = fp.read(stop - begin)
+        else:
+            text = fp.read()
+
+    nts = sum(1 for line in text.splitlines() if line.strip())
+    ncol = 6 + sum(var_counts)
+    block = np.fromstring(text, dtype=float, sep=' ')
+    if block.size != nts * ncol:
+        raise ValueError('could not parse the values in ' + cbhfn)
+    block = block.reshape(nts, ncol)
+
+    dates = date_index.to_datetime64(block[:, :3])
+    vals = np.ascontiguousarray(block[:, 6:])
+
+    if cache.enabled and not windowed:
+        cache.store(cbhfn, 'cbh', {'var_names': var_names, 'var_counts': var_counts}, {'dates': dates, 'vals': vals})
+    return var_names, var_counts, dates, vals
+
+
+if __name__ == '__main__':
+    var_names, var_counts, dates, vals = read('/work/markstro/operat/samples/nhm_animation_ncdf/prms_files/tmax.cbh')
+    print var_names, var_counts
+    print dates[0], dates[-1]
+    print vals
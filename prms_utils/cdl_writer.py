@@ -2,6 +2,71 @@ from prms_utils import get_param_info
 # from prms_utils import get_dim_list
 import numpy
 
+# Number of data values formatted at a time
+chunk_size = 100000
+
+# Size of the output file buffer
+buffer_size = 4 * 1024 * 1024
+
+
+# A block of values as one ', ' separated string. Without fmt, each value is the same as str() of it (numpy or
+# python), but numpy floats, ints and bools are formatted from a list all at once.
+def _format_values(vals, fmt=None):
+    if fmt is not None:
+        if isinstance(vals, numpy.ndarray):
+            vals = vals.tolist()
+        return (', '.join([fmt] * len(vals))) % tuple(vals)
+
+    if isinstance(vals, numpy.ndarray):
+        if vals.dtype == numpy.float64:
+            strs = map(repr, vals.tolist())
+        elif vals.dtype.kind in 'iub':
+            strs = map(str, vals.tolist())
+        else:
+            strs = [str(val) for val in vals]
+    else:
+        strs = map(str, vals)
+    return ', '.join(strs)
+
+
+# Write the values of a variable, flattened, a block at a time
+def _write_values(cdl_file, vals, fmt=None):
+    # Might need to check for type "list" as well
+    if isinstance(vals, numpy.ndarray):
+        flat_list = vals.ravel()
+    elif any(isinstance(i, numpy.ndarray) for i in vals):
+        flat_list = numpy.concatenate([numpy.ravel(sublist) for sublist in vals])
+    else:
+        flat_list = vals
+
+    sep = '  '
+    for ii in xrange(0, len(flat_list), chunk_size):
+        cdl_file.write(sep + _format_values(flat_list[ii:ii + chunk_size], fmt))
+        sep = ', '
+
+
+# Write the declaration of float variable name into the cdl file. attrs is a dictionary of its attributes, as for
+# prms_utils/ncf_writer.py. dims is the list of dimensions of the variable, eg 'time, hruid'.
+def write_variable(cdl_file, name, attrs, dims):
+    cdl_file.write('  float ' + name + '(' + dims + ');\n')
+    cdl_file.write('    ' + name + ':long_name = "' + attrs['long_name'] + '";\n')
+    cdl_file.write('    ' + name + ':units = "' + attrs['units'] + '";\n')
+    cdl_file.write('    ' + name + ':standard_name = "' + attrs['standard_name'] + '";\n')
+    if 'fill_value' in attrs:
+        cdl_file.write('    ' + name + ':_FillValue = ' + repr(attrs['fill_value']) + 'f;\n')
+
+
+# Write the (nts, nfeat) values of time series variable name into the cdl file, one line per time step
+def write_timeseries_values(cdl_file, name, vals, fmt='%.1f'):
+    cdl_file.write(name + ' =\n')
+    sep = ''
+    for row in vals:
+        cdl_file.write(sep)
+        _write_values(cdl_file, numpy.asarray(row), fmt)
+        sep = ',\n'
+    cdl_file.write('\n;\n\n')
+
+
 # Write a CDL format file
 #
 # cdl_file_name - full path to the cdl file to write
@@ -11,11 +76,12 @@ import numpy
 # ts_code - three or four character string specifying the standard code for the time zone of the base_date
 # dims - dictionary of dimensions to write into this cdl. key is name; value is the integer size
 # pinfo_file_name - full path to the xml file with the meta data about all parameters, vars, etc.
+# fmt - optional % format for the data values (eg '%.4f'). By default each value is written as str() of it.
 
 
-def cdl_writer(cdl_file_name, nc_name, nts, base_date, tz_code, var_list, dims_list, ps, xml_info_name):
+def cdl_writer(cdl_file_name, nc_name, nts, base_date, tz_code, var_list, dims_list, ps, xml_info_name, fmt=None):
     # print 'writing cdl file ' + cdl_file_name
-    cdl_file = open(cdl_file_name, 'w')
+    cdl_file = open(cdl_file_name, 'w', buffer_size)
     cdl_file.write('netcdf ' + nc_name + ' {' + '\n')
 
     # Write dimensions block
@@ -122,17 +188,15 @@ def cdl_writer(cdl_file_name, nc_name, nts, base_date, tz_code, var_list, dims_l
     cdl_file.write('\ndata:\n\n')
 
     # Time steps
-    cdl_file.write('time =\n  0')
-    for ii in xrange(1, nts + 1):
-        cdl_file.write(', ' + str(ii))
+    cdl_file.write('time =\n')
+    _write_values(cdl_file, numpy.arange(nts + 1))
     cdl_file.write(';\n\n')
 
     # IDs for the dimension indexes
     for key in dims_list:
         idname = key + 'id'
-        cdl_file.write(idname + ' =\n  1')
-        for ii in xrange(2, ps.get_dim_size(key) + 1):
-            cdl_file.write(', ' + str(ii))
+        cdl_file.write(idname + ' =\n')
+        _write_values(cdl_file, numpy.arange(1, max(ps.get_dim_size(key), 1) + 1))
         cdl_file.write(';\n\n')
 
     # # put in the parameter values
@@ -155,15 +219,7 @@ def cdl_writer(cdl_file_name, nc_name, nts, base_date, tz_code, var_list, dims_l
         # print var_list
         # print str(len(data_vals))
 
-        # Might need to check for type "list" as well
-        if any(isinstance(i, numpy.ndarray) for i in vals):
-            flat_list = [item for sublist in vals for item in sublist]
-        else:
-            flat_list = vals
-
-        cdl_file.write('  ' + str(flat_list[0]))
-        for ii in xrange(1, len(flat_list)):
-            cdl_file.write(', ' + str(flat_list[ii]))
+        _write_values(cdl_file, vals, fmt)
 
         cdl_file.write(';\n\n')
 
@@ -172,9 +228,10 @@ def cdl_writer(cdl_file_name, nc_name, nts, base_date, tz_code, var_list, dims_l
     cdl_file.close()
 
 
-def cdl_no_map_writer(cdl_file_name, nc_name, missing_val_set, all_values_dict, dims_set, ps, info_file_name):
+def cdl_no_map_writer(cdl_file_name, nc_name, missing_val_set, all_values_dict, dims_set, ps, info_file_name,
+                      fmt=None):
     # print 'writing cdl file ' + cdl_file_name
-    cdl_file = open(cdl_file_name, 'w')
+    cdl_file = open(cdl_file_name, 'w', buffer_size)
     cdl_file.write('netcdf ' + nc_name + ' {' + '\n')
 
     # Write dimensions block
@@ -231,9 +288,8 @@ def cdl_no_map_writer(cdl_file_name, nc_name, missing_val_set, all_values_dict,
     # IDs for the dimension indexes
     for key in dims_set:
         idname = key + 'id'
-        cdl_file.write(idname + ' =\n  1')
-        for ii in xrange(2, ps.get_dim_size(key) + 1):
-            cdl_file.write(', ' + str(ii))
+        cdl_file.write(idname + ' =\n')
+        _write_values(cdl_file, numpy.arange(1, max(ps.get_dim_size(key), 1) + 1))
         cdl_file.write(';\n\n')
 
     # put in the data file values
@@ -248,15 +304,7 @@ def cdl_no_map_writer(cdl_file_name, nc_name, missing_val_set, all_values_dict,
         # print var_list
         # print str(len(data_vals))
 
-        # Might need to check for type "list" as well
-        if any(isinstance(i, numpy.ndarray) for i in vals):
-            flat_list = [item for sublist in vals for item in sublist]
-        else:
-            flat_list = vals
-
-        cdl_file.write('  ' + str(flat_list[0]))
-        for ii in xrange(1, len(flat_list)):
-            cdl_file.write(', ' + str(flat_list[ii]))
+        _write_values(cdl_file, vals, fmt)
 
         cdl_file.write(';\n\n')
 
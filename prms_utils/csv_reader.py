@@ -1,7 +1,33 @@
 import numpy as np
 import csv
+import itertools
+import operator
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+from prms_utils import cache
+from prms_utils import date_index
+from prms_utils import follow
+
+# All of the readers in here return (nts, nfeat, base_date, vals), so they all use the cache the same way
+def _from_cache(csvfn, kind):
+    if cache.enabled:
+        cached = cache.load(csvfn, kind)
+        if cached is not None:
+            meta, arrays = cached
+            return meta['nts'], meta['nfeat'], meta['base_date'], arrays['vals']
+    return None
+
+
+def _to_cache(csvfn, kind, nts, nfeat, base_date, vals):
+    if cache.enabled:
+        cache.store(csvfn, kind, {'nts': nts, 'nfeat': nfeat, 'base_date': base_date}, {'vals': vals})
+
 
 def read(csvfn):
+    cached = _from_cache(csvfn, 'read')
+    if cached is not None:
+        return cached
+
     # figure out the number of features (ncol - 1)
     # figure out the number of timesteps (nrow -1)
     with open(csvfn, 'rb') as csvfile:
@@ -38,62 +64,409 @@ def read(csvfn):
                     kk = kk + 1
                 jj = jj + 1
             ii = ii + 1
+    _to_cache(csvfn, 'read', nts, nfeat, base_date, vals)
     return nts, nfeat, base_date, vals
 
 
-# Read a PRMS "output" csv. For these files, there is a remapping in the header line that tells the order of the columns
-def read_output(csvfn):
-    # figure out the number of features (ncol - 1)
-    # figure out the number of timesteps (nrow -1)
+# Split the data lines of a PRMS output csv into the date column and the rest of the line (the values).
+def _split_dates(lines):
+    dates = []
+    rows = []
+    for line in lines:
+        line = line.rstrip()
+        if line:
+            date, _, row = line.partition(',')
+            dates.append(date)
+            rows.append(row)
+    return dates, rows
+
+
+# Parse the value part of the rows all at once into a 2D array (nrows, ncol). Numpy does the string to float
+# conversion for the whole block so there is no per value work done in python.
+def _parse_rows(rows, ncol, csvfn):
+    vals = np.fromstring(','.join(rows), dtype=float, sep=',')
+    if vals.size != len(rows) * ncol:
+        raise ValueError('read_output: could not parse the values in ' + csvfn)
+    return vals.reshape(len(rows), ncol)
+
+
+# Read the header line of a PRMS output csv. After the date column, it has the (one based) feature index for each column.
+def _read_output_header(csvfile):
+    header = csvfile.readline().strip().split(',')
+    return np.array(header[1:], dtype=int)
+
+
+# Find the columns that hold feature_ids (as given in the header remapping) in a PRMS output csv
+def _feature_columns(indx, feature_ids, csvfn):
+    col_of_feat = dict(zip(indx, xrange(len(indx))))
+    try:
+        return [col_of_feat[fid] for fid in feature_ids]
+    except KeyError as e:
+        raise ValueError('feature ' + str(e.args[0]) + ' is not in ' + csvfn)
+
+
+# Keep only the value columns cols (in that order) from rows. Only the kept values get converted to floats.
+def _select_columns(rows, cols):
+    if len(cols) == 1:
+        return [row.split(',')[cols[0]] for row in rows]
+
+    getter = operator.itemgetter(*cols)
+    return [','.join(getter(row.split(','))) for row in rows]
+
+
+# Date of a line of a PRMS output csv, for the date index
+def _output_date(line):
+    y, m, d = line[:10].split('-')
+    return int(y), int(m), int(d)
+
+
+# The lines of an open file from byte begin up to byte end
+def _window_lines(fp, begin, end):
+    fp.seek(begin)
+    pos = begin
+    for line in fp:
+        if pos >= end:
+            return
+        yield line
+        pos += len(line)
+
+
+# Read the lines of an open file in chunks of (at most) chunk_size lines
+def _iter_lines(fp, chunk_size):
+    while True:
+        lines = list(itertools.islice(fp, chunk_size))
+        if not lines:
+            return
+        yield lines
+
+
+# State shared with the worker processes of a parallel read_output. Set up by _init_worker in each worker.
+_worker = {}
+
+
+def _init_worker(csvfn, indx, cols, raw, nts, ncol):
+    _worker['csvfn'] = csvfn
+    _worker['indx'] = indx
+    _worker['cols'] = cols
+    _worker['vals'] = np.frombuffer(raw).reshape(nts, ncol)
+
+
+def _read_range(csvfn, start, end):
     with open(csvfn, 'rb') as csvfile:
-        spamreader = csv.reader(csvfile)
+        csvfile.seek(start)
+        return csvfile.read(end - start)
 
-        header = spamreader.next()
-        nfeat = len(header) - 1
 
-        ii = 0
-        for row in spamreader:
-            ii = ii + 1
-        nts = ii
+# Number of data lines in bytes start to end of the file
+def _count_rows(args):
+    csvfn, start, end = args
+    return sum(1 for line in _read_range(csvfn, start, end).splitlines() if line.strip())
 
-    vals = np.zeros(shape=(nts,nfeat))
-    indx = np.zeros(shape=nfeat, dtype=int)
+
+# Parse bytes start to end of the file into the shared array, starting at row row0. Returns the dates.
+def _parse_range(args):
+    start, end, row0 = args
+    csvfn = _worker['csvfn']
+    indx = _worker['indx']
+    cols = _worker['cols']
+    vals = _worker['vals']
+
+    dates, rows = _split_dates(_read_range(csvfn, start, end).splitlines())
+    if rows:
+        if cols is None:
+            vals[row0:row0 + len(rows), indx - 1] = _parse_rows(rows, len(indx), csvfn)
+        else:
+            vals[row0:row0 + len(rows), :] = _parse_rows(_select_columns(rows, cols), len(cols), csvfn)
+    return dates
+
+
+# Split the data section of the file into one byte range per worker, each starting at the beginning of a line
+def _byte_ranges(csvfile, workers):
+    start = csvfile.tell()
+    csvfile.seek(0, 2)
+    size = csvfile.tell()
+
+    bounds = [start]
+    for ii in xrange(1, workers):
+        csvfile.seek(max(start + (size - start) * ii / workers, bounds[-1]))
+        csvfile.readline()
+        bounds.append(min(csvfile.tell(), size))
+    bounds.append(size)
+
+    return [(bounds[ii], bounds[ii + 1]) for ii in xrange(workers)]
+
+
+# Parallel version of read_output. The data section is split into byte ranges that line up with the line boundaries.
+# The rows in each range are counted and then parsed by the worker processes straight into a shared memory array, at
+# the row offset of the range.
+def _read_output_parallel(csvfn, workers, feature_ids):
     with open(csvfn, 'rb') as csvfile:
-        spamreader = csv.reader(csvfile)
+        indx = _read_output_header(csvfile)
+        ranges = _byte_ranges(csvfile, workers)
 
-        # Read the header line
-        header = spamreader.next()
-        for ii in xrange(1,len(header)):
-            indx[ii-1] = int(header[ii])
+    cols = None
+    nfeat = len(indx)
+    if feature_ids is not None:
+        cols = _feature_columns(indx, feature_ids, csvfn)
+        nfeat = len(cols)
 
-        print indx
+    pool = multiprocessing.Pool(workers)
+    try:
+        counts = pool.map(_count_rows, [(csvfn, start, end) for start, end in ranges])
+    finally:
+        pool.close()
+        pool.join()
 
-        # Read the CSV file values, line-by-line, column-by-column
-        ii = 0
-        for row in spamreader:
-            jj = 0
-            kk = 0
-            for tok in row:
-                # Now skip the date/time fields and put the values into the 2D array
-                if jj > 0:
-                    try:
-                        vals[ii][indx[kk]-1] = float(tok)
-                        kk = kk + 1
-                    except:
-                        print 'read_output: ', str(tok), str(ii), str(kk), str(indx[kk]-1)
-                else:
-                    # Get the base date (ie date of first time step) from the first row of values
-                    if ii == 0:
-                        base_date = tok
-                    print tok
+    nts = sum(counts)
+    raw = RawArray('d', nts * nfeat)
+    offsets = np.cumsum([0] + counts[:-1])
 
-                jj = jj + 1
-            ii = ii + 1
+    pool = multiprocessing.Pool(workers, _init_worker, (csvfn, indx, cols, raw, nts, nfeat))
+    try:
+        date_lists = pool.map(_parse_range, [(ranges[ii][0], ranges[ii][1], offsets[ii]) for ii in xrange(workers)])
+    finally:
+        pool.close()
+        pool.join()
+
+    dates = []
+    for dl in date_lists:
+        dates.extend(dl)
+
+    vals = np.frombuffer(raw).reshape(nts, nfeat)
+    return nts, nfeat, dates[0], vals
+
+
+# Read a PRMS "output" csv. For these files, there is a remapping in the header line that tells the order of the columns
+#
+# workers is the number of processes to parse the file with. None means one per cpu.
+#
+# feature_ids is an optional list of the features (the ids in the header remapping) to read. When it is given, only
+# those columns are parsed and vals has one column per id, in the order of feature_ids.
+#
+# start and end limit the read to the time steps from date start to date end (inclusive). The date index (see
+# date_index.py) is used to seek straight to start, so only the lines in the window are read. These reads don't go
+# through the cache and are always done in this process.
+def read_output(csvfn, workers=1, feature_ids=None, start=None, end=None):
+    if start is not None or end is not None:
+        return _read_output_chunks(csvfn, feature_ids, start, end)
+
+    cached = _from_cache(csvfn, 'read_output')
+    if cached is not None:
+        if feature_ids is None:
+            return cached
+        nts, nfeat, base_date, vals = cached
+        ids = np.asarray(feature_ids, dtype=int)
+        bad = ids[(ids < 1) | (ids > nfeat)]
+        if len(bad):
+            raise ValueError('feature ' + str(bad[0]) + ' is not in ' + csvfn)
+        return nts, len(feature_ids), base_date, vals[:, ids - 1]
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if workers > 1:
+        nts, nfeat, base_date, vals = _read_output_parallel(csvfn, workers, feature_ids)
+        if feature_ids is None:
+            _to_cache(csvfn, 'read_output', nts, nfeat, base_date, vals)
+        return nts, nfeat, base_date, vals
+
+    if feature_ids is not None:
+        return _read_output_chunks(csvfn, feature_ids)
+
+    with open(csvfn, 'rb') as csvfile:
+        indx = _read_output_header(csvfile)
+        nfeat = len(indx)
+
+        # Read the rest of the file in one pass
+        dates, rows = _split_dates(csvfile.read().splitlines())
+
+    nts = len(dates)
+
+    # Get the base date (ie date of first time step) from the first row of values
+    base_date = dates[0]
+
+    # Put the columns into feature order with one permutation of the whole block
+    vals = np.empty(shape=(nts, nfeat))
+    vals[:, indx - 1] = _parse_rows(rows, nfeat, csvfn)
+    _to_cache(csvfn, 'read_output', nts, nfeat, base_date, vals)
     return nts, nfeat, base_date, vals
 
+
+# read_output for just the columns of feature_ids and/or the dates from start to end. The file is read a chunk of lines
+# at a time and the unwanted columns are dropped as each chunk is read, so the memory used depends on the size of the
+# subset, not on the size of the file.
+def _read_output_chunks(csvfn, feature_ids=None, start=None, end=None, chunk_size=1000):
+    dates = []
+    blocks = []
+    for block_dates, block in iter_output(csvfn, chunk_size, feature_ids, start, end):
+        dates.extend(block_dates)
+        blocks.append(block)
+
+    if feature_ids is not None:
+        nfeat = len(feature_ids)
+    else:
+        with open(csvfn, 'rb') as csvfile:
+            nfeat = len(_read_output_header(csvfile))
+
+    if not dates:
+        return 0, nfeat, None, np.empty(shape=(0, nfeat))
+
+    vals = np.concatenate(blocks)
+    return len(dates), nfeat, dates[0], vals
+
+
+# Iterate over a PRMS "output" csv chunk_size time steps at a time. Yields (dates, vals) for each chunk, with the columns
+# of vals already remapped into feature order. Only one chunk is in memory at a time, so writers can convert and write
+# each chunk as it comes. feature_ids, start and end select columns and dates the same way as in read_output.
+def iter_output(csvfn, chunk_size=365, feature_ids=None, start=None, end=None):
+    with open(csvfn, 'rb') as csvfile:
+        indx = _read_output_header(csvfile)
+        nfeat = len(indx)
+
+        cols = None
+        if feature_ids is not None:
+            cols = _feature_columns(indx, feature_ids, csvfn)
+
+        source = csvfile
+        if start is not None or end is not None:
+            row0, row1, begin, stop = date_index.window(csvfn, csvfile.tell(), _output_date, start, end)
+            source = _window_lines(csvfile, begin, stop)
+
+        for lines in _iter_lines(source, chunk_size):
+            dates, rows = _split_dates(lines)
+            if cols is None:
+                vals = np.empty(shape=(len(dates), nfeat))
+                vals[:, indx - 1] = _parse_rows(rows, nfeat, csvfn)
+            else:
+                vals = _parse_rows(_select_columns(rows, cols), len(cols), csvfn)
+            yield dates, vals
+
+
+# Date (YYYY-MM-DD) of the first time step of a PRMS "output" csv. Only the header and the first data line are read.
+def output_base_date(csvfn):
+    with open(csvfn, 'rb') as csvfile:
+        csvfile.readline()
+        for line in csvfile:
+            if line.strip():
+                return line.partition(',')[0].strip()
+    return None
+
+
+# Feature ids (the header remapping) of the columns of a PRMS "output" csv
+def output_feature_ids(csvfn):
+    with open(csvfn, 'rb') as csvfile:
+        return _read_output_header(csvfile)
+
+
+# Size of the blocks that _tail_offset reads back from the end of the file with
+tail_block_size = 65536
+
+
+# Byte offset of the first data line dated start or later, found by reading back from the end of the file a block at
+# a time until a line before start (or the first data line, at byte data_start) is reached. Only the lines at the end of
+# the file get read, so this costs the same however long the file is.
+def _tail_offset(fp, data_start, start):
+    start = tuple(date_index.to_ymd([np.datetime64(start, 'D')])[0])
+    fp.seek(0, 2)
+    end = fp.tell()
+    pos = end
+    buf = ''
+    while pos > data_start:
+        prev = pos
+        pos = max(data_start, pos - tail_block_size)
+        fp.seek(pos)
+        buf = fp.read(prev - pos) + buf
+
+        # Drop the partial line at the start of the block, unless the block starts at the first data line
+        complete = buf
+        if pos > data_start:
+            nl = buf.find('\n')
+            if nl < 0:
+                continue
+            complete = buf[nl + 1:]
+
+        lines = complete.splitlines(True)
+        dated = [line for line in lines if line.strip()]
+        if not dated or (pos > data_start and _output_date(dated[0]) >= start):
+            continue
+
+        offset = end - len(complete)
+        for line in lines:
+            if line.strip() and _output_date(line) >= start:
+                return offset
+            offset += len(line)
+        return end
+    return end
+
+
+# read_output for the time steps from date start to the end of the file, found by reading back from the end of the file
+# (see _tail_offset) instead of with the date index. This is for picking up the few new days at the end of a long
+# file that is added to every day: the cost depends on the number of new lines, not on the length of the file.
+def read_output_tail(csvfn, start):
+    with open(csvfn, 'rb') as csvfile:
+        indx = _read_output_header(csvfile)
+        nfeat = len(indx)
+        csvfile.seek(_tail_offset(csvfile, csvfile.tell(), start))
+        dates, rows = _split_dates(csvfile.read().splitlines())
+
+    if not dates:
+        return 0, nfeat, None, np.empty(shape=(0, nfeat))
+
+    vals = np.empty(shape=(len(dates), nfeat))
+    vals[:, indx - 1] = _parse_rows(rows, nfeat, csvfn)
+    return len(dates), nfeat, dates[0], vals
+
+
+# Follow a PRMS "output" csv that a running model is writing. Each poll() returns (dates, vals) for the rows that were
+# added since the last poll, with the columns in feature order (or just the columns of feature_ids, as in read_output).
+class OutputFollower(follow.Follower):
+    def __init__(self, csvfn, feature_ids=None):
+        follow.Follower.__init__(self, csvfn)
+        self.feature_ids = feature_ids
+        self.indx = None
+        self.cols = None
+
+    def _read_header(self, fp):
+        line = follow.read_complete_line(fp)
+        if line is None:
+            return False
+
+        self.indx = np.array(line.strip().split(',')[1:], dtype=int)
+        if self.feature_ids is not None:
+            self.cols = _feature_columns(self.indx, self.feature_ids, self.fn)
+        return True
+
+    def _parse(self, lines):
+        dates, rows = _split_dates(lines)
+
+        if self.cols is not None:
+            vals = _parse_rows(_select_columns(rows, self.cols), len(self.cols), self.fn)
+        elif self.indx is not None:
+            vals = np.empty(shape=(len(rows), len(self.indx)))
+            vals[:, self.indx - 1] = _parse_rows(rows, len(self.indx), self.fn)
+        else:
+            vals = np.empty(shape=(0, 0))
+        return dates, vals
+
+
 # Read a PRMS "CBH" file. For these files, I cut off the header of the cbh files. There is no mapping info because
 # the values are in the order of the HRU IDs.
-def read_cbh(csvfn):
+#
+# start and end limit the read to the dates from start to end (inclusive), the same way as in read_output.
+def read_cbh(csvfn, start=None, end=None):
+    if start is not None or end is not None:
+        row0, row1, begin, stop = date_index.window(csvfn, 0, date_index.line_date, start, end)
+        with open(csvfn, 'rb') as csvfile:
+            csvfile.seek(begin)
+            dates, vals = _parse_cbh_lines(csvfile.read(stop - begin).splitlines(), csvfn)
+        if not dates:
+            return 0, 0, None, vals
+        return len(dates), vals.shape[1], dates[0], vals
+
+    cached = _from_cache(csvfn, 'read_cbh')
+    if cached is not None:
+        return cached
+
     # figure out the number of features (ncol - 1)
     # figure out the number of timesteps (nrow -1)
     with open(csvfn, 'rb') as csvfile:
@@ -125,9 +498,41 @@ def read_cbh(csvfn):
                     base_date = str(row[0]) + "-" + str(row[1]) + "-" + str(row[2])
 
             ii = ii + 1
+    _to_cache(csvfn, 'read_cbh', nts, nfeat, base_date, vals)
     return nts, nfeat, base_date, vals
 
 
+# Parse lines of a (header cut off) PRMS "CBH" file into the dates and a 2D array of the values. The dates are formatted
+# the same way as the base_date from read_cbh.
+def _parse_cbh_lines(lines, csvfn):
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return [], np.empty(shape=(0, 0))
+
+    # six date/time fields, then the values in HRU order
+    dates = ['-'.join(line.split(None, 3)[:3]) for line in lines]
+    ncol = len(lines[0].split())
+    vals = np.fromstring(' '.join(lines), dtype=float, sep=' ')
+    if vals.size != len(lines) * ncol:
+        raise ValueError('could not parse the values in ' + csvfn)
+    return dates, vals.reshape(len(lines), ncol)[:, 6:]
+
+
+# Iterate over a (header cut off) PRMS "CBH" file chunk_size time steps at a time. Yields (dates, vals) for each chunk.
+# start and end select dates the same way as in read_cbh.
+def iter_cbh(csvfn, chunk_size=365, start=None, end=None):
+    with open(csvfn, 'rb') as csvfile:
+        source = csvfile
+        if start is not None or end is not None:
+            row0, row1, begin, stop = date_index.window(csvfn, 0, date_index.line_date, start, end)
+            source = _window_lines(csvfile, begin, stop)
+
+        for lines in _iter_lines(source, chunk_size):
+            dates, vals = _parse_cbh_lines(lines, csvfn)
+            if dates:
+                yield dates, vals
+
+
 # tester
 if __name__ == '__main__':
     print read('/work/markstro/intern_demo/ModelInput/skunk_humid.csv')
\ No newline at end of file
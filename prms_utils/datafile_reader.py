@@ -1,5 +1,6 @@
 import numpy as np
-import datetime
+from prms_utils import cache
+from prms_utils import date_index
 
 
 def var_name_by_dim(dim_name):
@@ -13,8 +14,9 @@ def var_name_by_dim(dim_name):
     else:
         return []
 
-def read(dffn):
-    fp = open(dffn, "r")
+# Read the header of a data file, up to and including the #### line. Returns the station ids (one per data column) and
+# the position of each variable: [name, count, first column, last column] (all strings).
+def _read_header(fp):
     description = fp.readline()
 
 # Skip down to station/variable list in the comments
@@ -43,45 +45,81 @@ def read(dffn):
         split = line.split()
         cnt = int(split[1])
         split.append(str(idx)),
-        end = idx + cnt - 1
-        split.append(str(end))
-        idx = end + 1
+        last = idx + cnt - 1
+        split.append(str(last))
+        idx = last + 1
         var_positions_l.append(split)
         line = fp.readline()
 
-    line = fp.readline()
-
-# in the data section; count the number of lines to get the number of time steps
-    nts = 0
-    while len(line) > 0:
-        nts = nts + 1
-        line = fp.readline()
-
-    fp.close()
-
-# Need two arrays (1) 1-D for date-time stamp; (2) 2-D for values
-    dates_l = ["" for x in range(nts)]
-    nvals = len(id_l)
-    vals_l = np.zeros((nts, nvals))
-
-# Reopen the file, skip to data
-    fp = open(dffn, "r")
-    while '####' not in line:
-        line = fp.readline()
-    line = fp.readline()
+    return id_l, var_positions_l
+
+
+# Read the whole data file in one pass. Returns the station ids, the variable positions (see _read_header), the dates
+# (datetime64[D]) and a (nts, nvals) array of the values. The data section is parsed all at once.
+def _read(dffn, start=None, end=None):
+    windowed = start is not None or end is not None
+    if cache.enabled and not windowed:
+        cached = cache.load(dffn, 'datafile')
+        if cached is not None and 'dates' in cached[1]:
+            meta, arrays = cached
+            return meta['ids'], meta['var_positions'], arrays['dates'], arrays['vals']
+
+    with open(dffn, 'rb') as fp:
+        id_l, var_positions_l = _read_header(fp)
+
+        if windowed:
+            # seek to the first line of the window
+            row0, row1, begin, stop = date_index.window(dffn, fp.tell(), date_index.line_date, start, end)
+            fp.seek(begin)
+            text = fp.read(stop - begin)
+        else:
+            text = fp.read()
+
+# Each data line is the date/time (6 fields) and then the values
+    nts = sum(1 for line in text.splitlines() if line.strip())
+    ncol = 6 + len(id_l)
+    block = np.fromstring(text, dtype=float, sep=' ')
+    if block.size != nts * ncol:
+        raise ValueError('could not parse the values in ' + dffn)
+    block = block.reshape(nts, ncol)
+
+    dates = date_index.to_datetime64(block[:, :3])
+    vals = np.ascontiguousarray(block[:, 6:])
+
+    if cache.enabled and not windowed:
+        cache.store(dffn, 'datafile', {'ids': id_l, 'var_positions': var_positions_l},
+                    {'dates': dates, 'vals': vals})
+    return id_l, var_positions_l, dates, vals
+
+
+# Read a data file. Returns the station ids, the variable positions ([name, count, first column, last column]), the
+# dates as 'YYYY-MM-DD' strings and one (nts, nvals) array of all of the values.
+#
+# start and end limit the read to the dates from start to end (inclusive). The date index (see date_index.py) is used
+# to seek straight to start. These reads don't go through the cache.
+def read(dffn, start=None, end=None):
+    id_l, var_positions_l, dates, vals_l = _read(dffn, start, end)
+    dates_l = [str(d) for d in dates]
+    return id_l, var_positions_l, dates_l, vals_l
 
-# Read the data lines
-    ii = 0
-    while len(line) > 0:
-        split = line.split()
-        dates_l[ii] = split[0] + '-' + str("%02d" % int(split[1])) + '-' + str("%02d" % int(split[2]))
-        for jj in xrange(0, nvals):
-            vals_l[ii,jj] = float(split[jj+6])
-        ii = ii + 1
-        line = fp.readline()
 
-    fp.close()
-    return id_l, var_positions_l, dates_l, vals_l
+# Read a data file into one array per variable. Returns
+#   ids - dictionary of variable name to the list of station ids for that variable
+#   dates - datetime64[D] array of the dates
+#   vals - dictionary of variable name to a (nts, nstations) array of the values (views into one block)
+# start and end are the same as in read.
+def read_vars(dffn, start=None, end=None):
+    id_l, var_positions_l, dates, block = _read(dffn, start, end)
+
+    ids = {}
+    vals = {}
+    for pos in var_positions_l:
+        name = pos[0]
+        first = int(pos[-2])
+        last = int(pos[-1])
+        ids[name] = id_l[first:last + 1]
+        vals[name] = block[:, first:last + 1]
+    return ids, dates, vals
 
 
 if __name__ == '__main__':
@@ -0,0 +1,71 @@
+import numpy as np
+from prms_utils import date_index
+
+# Number of rows of the data section to format at a time
+chunk_size = 1000
+
+
+# Write a PRMS data file.
+#
+# dffn - name of the data file to write
+# var_names - the variables (runoff, precip, tmax, ...) in the order that they go into the file
+# ids - dictionary of variable name to the list of station ids for that variable
+# dates - the dates of the time steps; anything that converts to datetime64[D]
+# vals - dictionary of variable name to a (nts, nstations) array of the values. NaN is written as missing.
+# stations - optional dictionary of station id to (latitude, longitude, elevation) for the comment block
+# description - the first line of the file
+# fmt - the format of the values; either one format for everything or a dictionary of variable name to format
+#
+# This takes the same ids, dates and vals that datafile_reader.read_vars returns. The data section is formatted a chunk
+# of rows at a time, with one string format operation for each chunk.
+def write(dffn, var_names, ids, dates, vals, stations=None, description='Written by datafile_writer',
+          fmt='%.2f', missing=-999.0):
+    ymd = date_index.to_ymd(dates)
+    nts = len(ymd)
+
+    # Put all of the values into one block, in the column order of the file
+    blocks = []
+    col_fmts = []
+    for name in var_names:
+        block = np.asarray(vals[name], dtype=float).reshape(nts, -1)
+        if block.shape[1] != len(ids[name]):
+            raise ValueError('number of stations for ' + name + ' does not match the number of ids')
+        blocks.append(block)
+
+        if isinstance(fmt, dict):
+            col_fmts.extend([fmt[name]] * block.shape[1])
+        else:
+            col_fmts.extend([fmt] * block.shape[1])
+
+    block = np.empty(shape=(nts, 6 + len(col_fmts)))
+    block[:, :3] = ymd
+    block[:, 3:6] = 0.0
+    block[:, 6:] = np.concatenate(blocks, axis=1) if blocks else 0.0
+    values = block[:, 6:]
+    values[np.isnan(values)] = missing
+
+    row_fmt = ' '.join(['%d'] * 6 + col_fmts) + '\n'
+
+    with open(dffn, 'w') as fp:
+        fp.write(description.rstrip('\n') + '\n')
+
+        # Station metadata block. datafile_reader gets the station id and the variable name from here.
+        fp.write('// Station metadata (listed in the same order as the data):\n')
+        fp.write('// ID Type Latitude Longitude Elevation\n')
+        for name in var_names:
+            for sid in ids[name]:
+                line = '// ' + str(sid) + ' ' + name
+                if stations is not None and sid in stations:
+                    line += ' ' + ' '.join(str(x) for x in stations[sid])
+                fp.write(line + '\n')
+        fp.write('/' * 80 + '\n')
+
+        # Variable counts
+        for name in var_names:
+            fp.write(name + ' ' + str(len(ids[name])) + '\n')
+        fp.write('#' * 40 + '\n')
+
+        # Data section
+        for ii in xrange(0, nts, chunk_size):
+            chunk = block[ii:ii + chunk_size]
+            fp.write((row_fmt * len(chunk)) % tuple(chunk.ravel().tolist()))
@@ -0,0 +1,86 @@
+import numpy as np
+from prms_utils import cache
+
+# Line offset index, by date, for the data lines of the PRMS text files (output csv, CBH, statvar and data files).
+#
+# The index has the date and the byte offset of every data line. With it, a reader can seek straight to the first
+# line of a date window and parse only the lines in the window. It is built the first time that a window is asked for
+# and saved next to the file through the sidecar cache (see cache.py), which checks it against the size and the
+# modification time of the file, so an index for a file that has changed gets rebuilt.
+#
+# The data lines have to be in date order, which they are in all of these files.
+
+
+# Convert a (n, 3) array of year, month, day to datetime64[D]
+def to_datetime64(ymd):
+    ymd = np.asarray(ymd, dtype=int).reshape(-1, 3)
+    dates = (ymd[:, 0] - 1970).astype('datetime64[Y]')
+    dates = dates + (ymd[:, 1] - 1).astype('timedelta64[M]')
+    return dates + (ymd[:, 2] - 1).astype('timedelta64[D]')
+
+
+# Convert datetime64 dates to a (n, 3) int array of year, month, day
+def to_ymd(dates):
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    months = dates.astype('datetime64[M]')
+    ymd = np.empty(shape=(len(dates), 3), dtype=int)
+    ymd[:, 0] = dates.astype('datetime64[Y]').astype(int) + 1970
+    ymd[:, 1] = months.astype(int) % 12 + 1
+    ymd[:, 2] = (dates - months).astype(int) + 1
+    return ymd
+
+
+# Date of a data line that starts with the year, month and day separated by white space (CBH and data files). This
+# is the parse_date of those files.
+def line_date(line):
+    y, m, d = line.split(None, 3)[:3]
+    return int(y), int(m), int(d)
+
+
+# Scan the data lines of fn, which start at byte data_start. parse_date gets each (non blank) line and returns the
+# (year, month, day) of it. Returns the dates and the offsets of the lines; offsets has one more entry than dates,
+# the offset of the end of the last line.
+def build(fn, data_start, parse_date):
+    offsets = []
+    ymd = []
+    with open(fn, 'rb') as fp:
+        fp.seek(data_start)
+        pos = data_start
+        for line in fp:
+            if line.strip():
+                offsets.append(pos)
+                ymd.append(parse_date(line))
+            pos += len(line)
+    offsets.append(pos)
+
+    return to_datetime64(ymd), np.array(offsets, dtype=np.int64)
+
+
+# Get the index for fn from the sidecar, or build it (and save it) if there isn't one or the file has changed
+def get(fn, data_start, parse_date):
+    cached = cache.load(fn, 'date_index')
+    if cached is not None:
+        meta, arrays = cached
+        if meta['data_start'] == data_start:
+            return arrays['dates'], arrays['offsets']
+
+    dates, offsets = build(fn, data_start, parse_date)
+    cache.store(fn, 'date_index', {'data_start': data_start}, {'dates': dates, 'offsets': offsets})
+    return dates, offsets
+
+
+# Find the data lines of fn from date start to date end (both inclusive, None for no limit). start and end can be
+# anything that numpy.datetime64 takes: 'YYYY-MM-DD' strings, datetime objects or datetime64. Returns
+# (row0, row1, begin, end): the rows are row0 up to (not including) row1, in bytes begin up to (not including) end.
+def window(fn, data_start, parse_date, start=None, end=None):
+    dates, offsets = get(fn, data_start, parse_date)
+
+    row0 = 0
+    if start is not None:
+        row0 = int(np.searchsorted(dates, np.datetime64(start, 'D'), 'left'))
+
+    row1 = len(dates)
+    if end is not None:
+        row1 = max(row0, int(np.searchsorted(dates, np.datetime64(end, 'D'), 'right')))
+
+    return row0, row1, int(offsets[row0]), int(offsets[row1])
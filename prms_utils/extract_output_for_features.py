@@ -1,13 +1,14 @@
 # markstro
 # 2019-04-22
 #
-# Run this on files that have been created by animation_file_reader. These are some sort of CSV
-# files that have been created from PRMS animation files.
+# Run this on files that have been created by animation_file_reader.export. These are one binary file (and a json
+# header) per variable of a PRMS animation file.
 
 import numpy as np
 import pandas as pd
 from timeit import default_timer as timer
-import csv
+from prms_utils import animation_file_reader
+from prms_utils import topology
 
 nhm_seg = [1435, 1436, 1437, 1438, 1439, 1440, 1441, 1442, 1443, 1444, 1445, 1446, 1447, 1448, 1449, 1450, 1451, 1452,
            1453, 1454, 1455, 1456, 1457, 1458, 1459, 1460, 1461, 1462, 1463, 1464, 1465, 1466, 1467, 1468, 1469, 1470,
@@ -38,45 +39,44 @@ nhm_seg = [1435, 1436, 1437, 1438, 1439, 1440, 1441, 1442, 1443, 1444, 1445, 144
 
 # nhm_seg = [2,3]
 
+# Instead of the list above, extract the segments upstream of (and including) outlet, from the network in param_fn
+outlet = None
+# outlet = 1505
+param_fn = '/work/markstro/operat/setup/test/NHM-PRMS_CONUS/input/myparam.param'
+
 var_list = ['seg_outflow', 'seg_tave_water', 'seg_width']
 # var_list = ['seg_tave_water']
 
-def csv_reader(fn, num_rows, num_cols):
+# Read only the columns of the segments in segs, in that order, from the export of variable var_name in dir.
+# Returns the dates and a (nts, len(segs)) array. Raises ValueError for a segment that isn't in the export.
+def export_reader(dir, var_name, segs):
     start = timer()
-    v1 = np.zeros(shape=[num_rows, num_cols])
-
-    with open(fn) as csv_file:
-        csv_reader = csv.reader(csv_file, delimiter=',')
-        ii = 0
-        for row in csv_reader:
-            for jj in xrange(num_segs):
-                v1[ii,jj] = float(row[jj])
-            ii += 1
+    dates, feature_ids, vals = animation_file_reader.read_export(dir, var_name)
+    feature_ids = np.asarray(feature_ids)
+    segs = np.asarray(segs)
+    cols = np.minimum(np.searchsorted(feature_ids, segs), len(feature_ids) - 1)
+    missing = segs[feature_ids[cols] != segs]
+    if len(missing):
+        raise ValueError('segment ' + str(missing[0]) + ' is not in the export of ' + var_name)
+    v1 = np.asarray(vals[:, cols])
 
     end = timer()
     print("time to read ", str(end - start))  # Time in seconds
 
-    return v1
+    return dates, v1
 
 
 if __name__ == '__main__':
     dir = '/ssd/markstro/conusStreamTemp/work_lev3/out/'
-    dates_fn = 'dates.txt'
-    dates = np.loadtxt(dir + dates_fn, dtype=str)
 
-    for ii in xrange(len(var_list)):
-        fn = dir + var_list[ii] + '.txt'
-        print "reading ", fn
+    if outlet is not None:
+        nhm_seg = np.sort(topology.read(param_fn).upstream_segments(outlet)).tolist()
 
-        num_segs = 56460
-        v1 = csv_reader(fn, len(dates), num_segs)
-        print v1
+    for ii in xrange(len(var_list)):
+        print "reading ", var_list[ii]
 
-        vals = np.zeros(shape=[len(dates), len(nhm_seg)])
-        for jj in xrange(len(dates)):
-            for kk in xrange(len(nhm_seg)):
-                # vals[jj,kk] = v1[nhm_seg[kk] - 1,jj]
-                vals[jj, kk] = v1[jj, nhm_seg[kk] - 1]
+        dates, vals = export_reader(dir, var_list[ii], nhm_seg)
+        print vals
 
         # Write the output cvs file
         fn2 = dir + var_list[ii] + '.csv'
@@ -90,7 +90,7 @@ if __name__ == '__main__':
         fp.write('\n')
 
         for jj in xrange(len(dates)):
-            fp.write(dates[jj])
+            fp.write(str(dates[jj]))
             for kk in xrange(len(nhm_seg)):
                 fp.write(',' + str(vals[jj,kk]))
 
@@ -0,0 +1,54 @@
+# Follow ("tail -f") a text file that a running model is still writing.
+#
+# A follower keeps the header of the file and the offset of the end of the last complete line that it has read. Each
+# poll() reads from that offset to the current end of the file and returns only the complete lines that were added
+# since the last poll. A last line that is still being written is left for the next poll. If the file gets shorter
+# (the model was started again), the follower starts over from the header.
+#
+# The readers subclass this and fill in _read_header and _parse (see csv_reader.OutputFollower and
+# statvar_reader.StatvarFollower).
+
+
+class Follower(object):
+    def __init__(self, fn):
+        self.fn = fn
+        # offset of the first line that hasn't been read yet; None until the header has been read
+        self.offset = None
+
+    # Read the header from the start of the file. Return False if it isn't all there yet.
+    def _read_header(self, fp):
+        raise NotImplementedError
+
+    # Parse complete lines into whatever poll() returns
+    def _parse(self, lines):
+        raise NotImplementedError
+
+    def poll(self):
+        with open(self.fn, 'rb') as fp:
+            fp.seek(0, 2)
+            size = fp.tell()
+
+            if self.offset is not None and size < self.offset:
+                self.offset = None
+
+            if self.offset is None:
+                fp.seek(0)
+                if not self._read_header(fp):
+                    return self._parse([])
+                self.offset = fp.tell()
+
+            fp.seek(self.offset)
+            data = fp.read(size - self.offset)
+
+        # keep only the complete lines
+        end = data.rfind('\n') + 1
+        self.offset += end
+        return self._parse(data[:end].splitlines(True))
+
+
+# Read one line, but only if it is complete
+def read_complete_line(fp):
+    line = fp.readline()
+    if not line.endswith('\n'):
+        return None
+    return line
@@ -1,23 +1,17 @@
-def get_dim_list_for_cbh(key):
-    if key == 'humidity_hru':
-        foo_dim = ['time', 'nhru']
-    elif key == 'tmaxf':
-        foo_dim = ['time', 'nhru']
-    elif key == 'tminf':
-        foo_dim = ['time', 'nhru']
-    elif key == 'hru_ppt':
-        foo_dim = ['time', 'nhru']
-    elif key == 'potet':
-        foo_dim = ['time', 'nhru']
-    elif key == 'swrad':
-        foo_dim = ['time', 'nhru']
-    elif key == 'transp_on':
-        foo_dim = ['time', 'nhru']
-    elif key == 'transp_on':
-        foo_dim = ['time', 'nhru']
-    elif key == 'windspeed_hru':
-        foo_dim = ['time', 'nhru']
-    else:
-        foo_dim = None
+# Dimensions of the CBH (climate by HRU) variables
+cbh_dims = {
+    'humidity_hru': ['time', 'nhru'],
+    'tmaxf': ['time', 'nhru'],
+    'tminf': ['time', 'nhru'],
+    'hru_ppt': ['time', 'nhru'],
+    'potet': ['time', 'nhru'],
+    'swrad': ['time', 'nhru'],
+    'transp_on': ['time', 'nhru'],
+    'windspeed_hru': ['time', 'nhru'],
+}
+
 
-    return foo_dim
\ No newline at end of file
+def get_dim_list_for_cbh(key):
+    if key in cbh_dims:
+        return list(cbh_dims[key])
+    return None
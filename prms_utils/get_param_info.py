@@ -1,33 +1,61 @@
 import xml.etree.ElementTree
+from prms_utils import cache
+from prms_utils import get_dim_list_for_cbh
 from prms_utils import paramfile
 # from prms_utils import get_dim_list
 
-# Global vars
-e = None
+# Parameter metadata registries that have been read, by xml file name. Each one is a dictionary of parameter name to
+# [long_name, units, standard_name, type_code, dims].
+registries = {}
 
+# The registries are small, so they are kept in the sidecar cache next to the xml file (see cache.py) whether the cache
+# is enabled or not. An entry is only used while the xml file has the same size, modification time and contents.
+persist_registry = True
 
-def get_param_info(pname, pfn):
-    global e
-    if e is None:
-        e = xml.etree.ElementTree.parse(pfn).getroot()
 
-    found = False
-    for pa in e.findall('parameter'):
-        name = pa.get('name')
-        if name == pname:
-            units = pa.get('units')
-            long_name = pa.get('desc')
-            standard_name = pa.get('cf_name')
-            type_code = pa.get('type')
-            d = pa.get('dims')
-            dims =d.split(',')
-
-            found = True
-            break
-
-    if not found:
+# Read the parameter metadata in pfn (parameters.xml) into a registry, with one pass of iterparse. The dimensions of
+# the CBH variables are merged in for the names that don't have any. The registry is kept next to the xml file (see
+# persist_registry) and only read again if the file changes.
+def read_registry(pfn):
+    if persist_registry or cache.enabled:
+        cached = cache.load(pfn, 'param_info')
+        if cached is not None:
+            return cached[0]['registry']
+
+    registry = {}
+    for event, pa in xml.etree.ElementTree.iterparse(pfn):
+        if pa.tag != 'parameter':
+            continue
+
+        d = pa.get('dims')
+        dims = d.split(',') if d is not None else None
+        registry[pa.get('name')] = [pa.get('desc'), pa.get('units'), pa.get('cf_name'), pa.get('type'), dims]
+        pa.clear()
+
+    for name in get_dim_list_for_cbh.cbh_dims:
+        info = registry.setdefault(name, [None, None, None, None, None])
+        if not info[4] or info[4] == ['']:
+            info[4] = get_dim_list_for_cbh.get_dim_list_for_cbh(name)
+
+    if persist_registry or cache.enabled:
+        cache.store(pfn, 'param_info', {'registry': registry}, {})
+    return registry
+
+
+# The registry for pfn, read the first time that it is needed
+def get_registry(pfn):
+    if pfn not in registries:
+        registries[pfn] = read_registry(pfn)
+    return registries[pfn]
+
+
+def get_param_info(pname, pfn):
+    registry = get_registry(pfn)
+    if pname not in registry:
         print 'did not find ', pname
+        return None, None, None, None, None
 
+    long_name, units, standard_name, type_code, dims = registry[pname]
     return long_name, units, standard_name, type_code, dims
 
 
@@ -0,0 +1,319 @@
+import numpy as np
+import datetime
+import getpass
+from netCDF4 import Dataset
+
+# Write CF-1.8 time series NetCDF files of PRMS values straight from numpy arrays, without going through CDL text and
+# ncgen.
+#
+# The layout is the one that out2ncf/prms_outputs2_ncf.py writes: an unlimited time dimension, one dimension for each
+# kind of feature (hruid, segid, ...) with an integer id variable of the same name, georeference variables (lat, lon)
+# on the feature dimensions and time series variables on (time, feature).
+#
+# Variable attributes are given as dictionaries with long_name, standard_name, units and, optionally, fill_value and
+# storage. georef_attrs and timeseries_attrs make these from the variable_info.json control file.
+#
+# storage sets how a time series variable is laid out in the file. It is a dictionary, all keys optional:
+#   chunks - 'map', 'timeseries' or an explicit (time, feature) chunk shape. 'map' chunks hold every feature for one
+#            day, which is how the animation viewer reads. 'timeseries' chunks hold many days for a few features, which
+#            is how per-gage extraction reads.
+#   zlib, complevel, shuffle - compression, as in netCDF4.Dataset.createVariable
+#   dtype - 'f8' (default), 'f4' or 'i2'. 'i2' packs the values into shorts with scale_factor and add_offset, which
+#           are computed from the range of the values unless they are given as scale_factor and add_offset here.
+#           Files that will be appended to must give them: the range of the first days says nothing about the days to
+#           come, and the packing can't change once the file is written.
+# With no storage the variables are float64 with the netCDF4 default chunking and no compression.
+#
+# Files can be added to after they are written: open_append checks that an existing file matches what would be
+# written now, next_date gives the first date that is not in it yet and append writes the new time steps onto the end
+# of the unlimited time dimension.
+
+# Chunk length in time and in features of the 'timeseries' chunks
+timeseries_chunk_days = 3653
+timeseries_chunk_features = 8
+
+# storage for files that are mostly looked at a day at a time (the animation viewer): float32 like the cdl files,
+# compressed, in one chunk per day. Use 'chunks': 'timeseries' for files that are mostly read one feature at a time.
+map_storage = {'chunks': 'map', 'zlib': True, 'complevel': 4, 'shuffle': True, 'dtype': 'f4'}
+
+# _FillValue of packed short variables, and the largest packed value
+_packed_fill = -32767
+_packed_max = 32766
+
+
+# Feature dimensions that the output variables of the control file can be on, with their georeference variables
+feature_georefs = [('hruid', 'hru_lat', 'hru_lon'), ('segid', 'seg_lat', 'seg_lon')]
+
+
+# Attributes of georeference variable name from the control file
+def georef_attrs(cntl, name):
+    info = cntl["feature_georef"][name]
+    return {'dimid': info["dimid"], 'long_name': info["long_name"], 'standard_name': info["standard_name"],
+            'units': info["units"], 'fill_value': float(info["fill_value"])}
+
+
+# Attributes of output variable name from the control file
+# The storage is ncf_storage of the control file, with any ncf_storage of the variable on top of it.
+def timeseries_attrs(cntl, name):
+    info = cntl["output_variables"][name]
+    storage = dict(cntl.get("ncf_storage", {}))
+    storage.update(info.get("ncf_storage", {}))
+    return {'dimid': info["georef"]["dimid"], 'long_name': info["long_name"], 'standard_name': info["standard_name"],
+            'units': info["out_units"], 'fill_value': float(info["fill_value"]), 'storage': storage}
+
+
+# Create the file with the time dimension, the feature dimensions and their ids, and the global attributes.
+#
+# ncf_name - file to write
+# base_date - 'YYYY-MM-DD' of time step 0
+# tz_code - time zone offset of the timestamps (eg '-05:00')
+# dims - list of (dimid, number of features)
+# history_name - name of the program for the history attribute
+def create(ncf_name, base_date, tz_code, dims, history_name):
+    ncf = Dataset(ncf_name, 'w', format='NETCDF4_CLASSIC')
+
+    # Write dimensions block
+    for dimid, size in dims:
+        ncf.createDimension(dimid, size)
+    ncf.createDimension('time', None)
+
+    # Put in the indexes for the dimensions
+    time_idx = ncf.createVariable("time", np.int32, ("time"), )
+    time_idx.long_name = "time"
+    time_idx.standard_name = "time"
+    time_idx.units = "days since " + base_date + " 00:00" + tz_code
+
+    for dimid, size in dims:
+        idx = ncf.createVariable(dimid, np.int32, (dimid), )
+        idx.cf_role = "timeseries_id"
+        idx.long_name = "local model " + dimid[:-2] + " id"
+        idx[:] = np.arange(1, size + 1, 1)
+
+    ncf.conventions = "CF-1.8"
+    ncf.featureType = "timeSeries"
+    ncf.history = str(datetime.datetime.now()) + ',' + str(getpass.getuser()) + ',' + history_name
+    return ncf
+
+
+def _set_attrs(v1, attrs):
+    v1.long_name = attrs["long_name"]
+    v1.standard_name = attrs["standard_name"]
+    v1.units = attrs["units"]
+
+
+# Add a georeference variable (on a feature dimension) and write its values
+def add_georef(ncf, name, attrs, vals):
+    v1 = ncf.createVariable(name, np.float64, (attrs["dimid"]), fill_value=attrs.get("fill_value"))
+    _set_attrs(v1, attrs)
+    v1[:] = vals
+    return v1
+
+
+# Chunk shape for the chunks setting of storage
+def chunk_shape(chunks, nfeat):
+    if chunks == 'map':
+        return 1, nfeat
+    elif chunks == 'timeseries':
+        return timeseries_chunk_days, min(timeseries_chunk_features, nfeat)
+    return tuple(chunks)
+
+
+# scale_factor and add_offset that pack the range of vals into shorts. NaNs are left out of the range (they are
+# written as _FillValue); with no values at all the packing is 1 and 0.
+def packing(vals):
+    vals = np.asarray(vals)
+    if vals.size == 0 or np.isnan(vals).all():
+        return 1.0, 0.0
+    lo = float(np.nanmin(vals))
+    hi = float(np.nanmax(vals))
+    scale_factor = (hi - lo) / (2 * _packed_max)
+    if scale_factor == 0.0:
+        scale_factor = 1.0
+    return scale_factor, (hi + lo) / 2.0
+
+
+# Raise ValueError if time series variable name can't be appended to, ie it is packed with a scale_factor worked out
+# from the values that are written first
+def check_appendable(name, attrs):
+    storage = attrs.get("storage") or {}
+    if storage.get("dtype", "f8") == "i2" and "scale_factor" not in storage:
+        raise ValueError(name + ": 'i2' storage of a file that is appended to needs scale_factor and add_offset")
+
+
+# Add a time series variable on (time, feature). vals are only needed to work out the packing of 'i2' variables
+# that have no scale_factor in their storage.
+def add_timeseries(ncf, name, attrs, vals=None):
+    storage = attrs.get("storage") or {}
+    dimid = attrs["dimid"]
+    dtype = storage.get("dtype", "f8")
+
+    kwargs = {}
+    if "chunks" in storage:
+        kwargs["chunksizes"] = chunk_shape(storage["chunks"], len(ncf.dimensions[dimid]))
+    for key in ("zlib", "complevel", "shuffle"):
+        if key in storage:
+            kwargs[key] = storage[key]
+
+    if dtype == "i2":
+        fill_value = _packed_fill
+    else:
+        fill_value = attrs.get("fill_value")
+
+    v1 = ncf.createVariable(name, dtype, ("time", dimid), fill_value=fill_value, **kwargs)
+    _set_attrs(v1, attrs)
+
+    if dtype == "i2":
+        if "scale_factor" in storage:
+            scale_factor, add_offset = storage["scale_factor"], storage.get("add_offset", 0.0)
+        else:
+            scale_factor, add_offset = packing(vals)
+        v1.scale_factor = scale_factor
+        v1.add_offset = add_offset
+    return v1
+
+
+# Write a (nts, nfeat) block of values starting at time step start, all in one call. The time index is written over
+# the block too. NaNs are masked, so that netCDF4 stores them as _FillValue (a NaN would otherwise be packed into an
+# ordinary short in 'i2' variables).
+def write_timeseries_values(ncf, nc_var, vals, start=0):
+    vals = np.ma.masked_invalid(np.asarray(vals, dtype=float))
+    nts = len(vals)
+    nc_var[start:start + nts, :] = vals
+    ncf.variables["time"][start:start + nts] = np.arange(start, start + nts, 1)
+
+
+# Write a whole file.
+#
+# dims - list of (dimid, number of features)
+# georefs - list of (name, attrs, vals)
+# timeseries - list of (name, attrs, vals), vals is (nts, nfeat)
+# storage - storage of the time series that have none in their attrs
+# appendable - the file will be appended to later (see check_appendable). This is checked before the file is made.
+def write(ncf_name, base_date, tz_code, dims, georefs, timeseries, history_name, storage=None, appendable=False):
+    if storage:
+        timeseries = [(name, attrs if attrs.get("storage") else dict(attrs, storage=storage), vals)
+                      for name, attrs, vals in timeseries]
+    if appendable:
+        for name, attrs, vals in timeseries:
+            check_appendable(name, attrs)
+
+    ncf = create(ncf_name, base_date, tz_code, dims, history_name)
+
+    for name, attrs, vals in georefs:
+        add_georef(ncf, name, attrs, vals)
+
+    for name, attrs, vals in timeseries:
+        nc_var = add_timeseries(ncf, name, attrs, vals)
+        write_timeseries_values(ncf, nc_var, vals)
+
+    ncf.close()
+
+
+# Feature dimensions and georeference variables of a file for the control file. georef_vals is a dictionary of the
+# values of the georeference variables (hru_lat, ...); the dimensions that have their georeferences in it are used.
+# Returns dims and georefs as write takes them.
+def cntl_layout(cntl, georef_vals):
+    dims = []
+    georefs = []
+    for dimid, lat_name, lon_name in feature_georefs:
+        if lat_name in georef_vals:
+            dims.append((dimid, len(georef_vals[lat_name])))
+            georefs.append((lat_name, georef_attrs(cntl, lat_name), georef_vals[lat_name]))
+            georefs.append((lon_name, georef_attrs(cntl, lon_name), georef_vals[lon_name]))
+    return dims, georefs
+
+
+# Write a whole file of the output variables var_names of the control file, with values val_list. georef_vals is as in
+# cntl_layout. appendable is as in write.
+def write_cntl(ncf_name, cntl, base_date, var_names, val_list, georef_vals, history_name, appendable=False):
+    dims, georefs = cntl_layout(cntl, georef_vals)
+    timeseries = []
+    for ii in xrange(len(var_names)):
+        timeseries.append((var_names[ii], timeseries_attrs(cntl, var_names[ii]), val_list[ii]))
+    write(ncf_name, base_date, cntl["tz_code"], dims, georefs, timeseries, history_name, appendable=appendable)
+
+
+# Open an existing file to add time steps to. The time units (so the base date and the time zone), the feature
+# dimensions and their ids, and the time series variables and their units have to be the same as what write would
+# make from the same arguments, otherwise ValueError is raised.
+#
+# timeseries - list of (name, attrs)
+def open_append(ncf_name, base_date, tz_code, dims, timeseries):
+    ncf = Dataset(ncf_name, 'a')
+    try:
+        units = "days since " + base_date + " 00:00" + tz_code
+        if ncf.variables["time"].units != units:
+            raise ValueError(ncf_name + ': time units are "' + ncf.variables["time"].units + '", not "' + units + '"')
+
+        for dimid, size in dims:
+            if dimid not in ncf.dimensions or len(ncf.dimensions[dimid]) != size:
+                raise ValueError(ncf_name + ': dimension ' + dimid + ' does not have ' + str(size) + ' features')
+            if not np.array_equal(ncf.variables[dimid][:], np.arange(1, size + 1, 1)):
+                raise ValueError(ncf_name + ': feature ids of ' + dimid + ' are not the same')
+
+        for name, attrs in timeseries:
+            if name not in ncf.variables:
+                raise ValueError(ncf_name + ': there is no variable ' + name)
+            nc_var = ncf.variables[name]
+            if nc_var.dimensions != ("time", attrs["dimid"]) or nc_var.units != attrs["units"]:
+                raise ValueError(ncf_name + ': variable ' + name + ' is not on (time, ' + attrs["dimid"] +
+                                 ') in ' + attrs["units"])
+    except Exception:
+        ncf.close()
+        raise
+    return ncf
+
+
+# Date ('YYYY-MM-DD') of the time step after the last one in the file
+def next_date(ncf):
+    time_idx = ncf.variables["time"]
+    base_date = np.datetime64(time_idx.units.split()[2], 'D')
+    if len(time_idx) == 0:
+        return str(base_date)
+    return str(base_date + int(time_idx[-1]) + 1)
+
+
+# Raise ValueError if the (nts, nfeat) block vals can't be appended to time series variable name, because it doesn't
+# have one column for each feature of the variable's dimension
+def check_append(ncf, name, vals):
+    dimid = ncf.variables[name].dimensions[1]
+    nfeat = len(ncf.dimensions[dimid])
+
+    vals = np.asarray(vals)
+    if vals.ndim != 2 or vals.shape[1] != nfeat:
+        raise ValueError(name + ': values have shape ' + str(vals.shape) + ', the file has ' + str(nfeat) + ' ' + dimid)
+
+
+# Raise ValueError if feature_ids (eg the header remapping of a csv file, in any order) aren't the ids of the features
+# of time series variable name in the file
+def check_feature_ids(ncf, name, feature_ids):
+    dimid = ncf.variables[name].dimensions[1]
+    if not np.array_equal(np.sort(np.asarray(feature_ids)), ncf.variables[dimid][:]):
+        raise ValueError(name + ': feature ids are not the ' + dimid + ' of the file')
+
+
+# Add (nts, nfeat) blocks of values to the time series variables, after the last time step in the file. All of the
+# blocks must have the same number of time steps.
+#
+# timeseries - list of (name, vals)
+def append(ncf, timeseries):
+    # Everything is checked before anything is written, so a failed append leaves the file as it was
+    nts = None
+    for name, vals in timeseries:
+        check_append(ncf, name, vals)
+        if nts is not None and len(vals) != nts:
+            raise ValueError('number of time steps to append is not the same for all of the variables')
+        nts = len(vals)
+
+    # Packed variables keep the scale_factor and add_offset they were made with
+    for name, vals in timeseries:
+        nc_var = ncf.variables[name]
+        if nc_var.dtype == np.int16 and len(vals):
+            lo = nc_var.add_offset - nc_var.scale_factor * _packed_max
+            hi = nc_var.add_offset + nc_var.scale_factor * _packed_max
+            if np.nanmin(vals) < lo or np.nanmax(vals) > hi:
+                raise ValueError('values of ' + name + ' are outside of the packed range ' + str(lo) + ' to ' + str(hi))
+
+    start = len(ncf.variables["time"])
+    for name, vals in timeseries:
+        write_timeseries_values(ncf, ncf.variables[name], vals, start)
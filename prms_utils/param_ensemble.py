@@ -0,0 +1,190 @@
+import numpy as np
+import os
+import collections
+from prms_utils import paramfile
+from prms_utils.parameter import Parameter
+
+# Ensemble of parameter sets that differ from one base parameter file in a few parameters.
+#
+# The base ParamFile is held once. Each member only keeps the arrays of the parameters that it changes, so memory and
+# disk grow with the size of the changes and not with the number of members. A parameter that a member only changes
+# a few values of (the name_## updates) is kept as just those (flat index, value) pairs, and the whole array is only
+# made when it is needed. A member's parameter file is written with ParamFile.write on the base, with the member's
+# parameters swapped in, so the value lines of all of the other parameters are copied straight from the base file.
+
+
+class ParamEnsemble(object):
+    # base is a ParamFile that has been read (lazily is fine)
+    def __init__(self, base):
+        self.base = base
+        # for each member, a dictionary of parameter name to the values that it uses instead of the base values
+        self.members = []
+        # for each member, a dictionary of parameter name to (flat indexes, values) for the parameters that it only
+        # changes some of the values of. The indexes are zero based, into the values in Fortran order.
+        self.indexed = []
+
+    def __len__(self):
+        return len(self.members)
+
+    # Add a member with the given parameter name to values dictionary and, optionally, a parameter name to
+    # (flat indexes, values) dictionary of the parameters that only have some values changed. Returns the index of the
+    # member.
+    def add_member(self, overrides=None, indexed=None):
+        member = collections.OrderedDict()
+        if overrides is not None:
+            for name, vals in overrides.items():
+                if name not in self.base.params:
+                    raise ValueError(name + ' is not in ' + self.base.file_name)
+                member[name] = np.asfortranarray(vals)
+
+        member_indexed = collections.OrderedDict()
+        if indexed is not None:
+            for name, (indexes, values) in indexed.items():
+                if name not in self.base.params:
+                    raise ValueError(name + ' is not in ' + self.base.file_name)
+                indexes = np.asarray(indexes, dtype=int)
+                size = np.size(self.base.params[name].vals)
+                if np.any(indexes < 0) or np.any(indexes >= size):
+                    raise ValueError('index out of range for ' + name + ', which has ' + str(size) + ' values')
+                member_indexed[name] = (indexes, np.asarray(values))
+
+        self.members.append(member)
+        self.indexed.append(member_indexed)
+        return len(self.members) - 1
+
+    # Add a member made from a list of (param_name, new_mean, lo, hi) updates on the base (see
+    # paramfile.updated_values). The parameters that only have name_## updates are kept as (index, value) pairs.
+    # Returns the index of the member.
+    def add_updates(self, updates):
+        whole = set()
+        for param_name, new_mean, lo, hi in updates:
+            if paramfile._indexed_name.match(param_name) is None:
+                whole.add(param_name)
+
+        indexed = collections.OrderedDict()
+        rest = []
+        for param_name, new_mean, lo, hi in updates:
+            m = paramfile._indexed_name.match(param_name)
+            if m is None or m.group(1) in whole:
+                rest.append((param_name, new_mean, lo, hi))
+            else:
+                indexes, values = indexed.setdefault(m.group(1), ([], []))
+                indexes.append(int(m.group(2)) - 1)
+                values.append(min(max(new_mean, lo), hi))
+
+        return self.add_member(paramfile.updated_values(self.base, rest), indexed)
+
+    # Values of parameter name for member ii
+    def get_param_vals(self, ii, name):
+        if name in self.members[ii]:
+            return self.members[ii][name]
+        if name in self.indexed[ii]:
+            return self._expand(name, *self.indexed[ii][name])
+        return self.base.params[name].vals
+
+    # Base values of parameter name with the values at the flat indexes set
+    def _expand(self, name, indexes, values):
+        vals = np.array(self.base.params[name].vals, order='F')
+        vals.reshape(-1, order='F')[indexes] = values
+        return vals
+
+    # Write the parameter file of member ii
+    def write_member(self, ii, pfn):
+        if os.path.exists(pfn) and os.path.samefile(pfn, self.base.file_name):
+            raise ValueError('will not write a member over the base parameter file ' + pfn)
+
+        changed = collections.OrderedDict(self.members[ii])
+        for name, (indexes, values) in self.indexed[ii].items():
+            changed[name] = self._expand(name, indexes, values)
+
+        saved = {}
+        for name, vals in changed.items():
+            p = self.base.params[name]
+            q = Parameter()
+            q.name = p.name
+            q.dims = p.dims
+            q.type_code = p.type_code
+            q.vals = vals
+            saved[name] = p
+            self.base.params[name] = q
+
+        try:
+            self.base.write(pfn)
+        finally:
+            self.base.params.update(saved)
+
+    # Write the parameter files of all of the members. file_pattern gets the member index, eg 'run_%04d.params'.
+    def write_all(self, file_pattern):
+        fns = []
+        for ii in xrange(len(self.members)):
+            fn = file_pattern % ii
+            self.write_member(ii, fn)
+            fns.append(fn)
+        return fns
+
+    # Add n members with values drawn from ranges, a list of (param_name, lo, hi). Each name gets a value from lo to
+    # hi, which is used as in add_updates: a name ending in _## sets that value, any other name rescales the whole
+    # parameter to that mean. method is 'uniform' or 'lhs' (Latin hypercube). Returns the (n, len(ranges)) array of
+    # the values and the indexes of the new members.
+    def sample(self, ranges, n, method='uniform', seed=None):
+        rng = np.random.RandomState(seed)
+        lo = np.array([r[1] for r in ranges], dtype=float)
+        hi = np.array([r[2] for r in ranges], dtype=float)
+
+        if method == 'uniform':
+            unit = rng.rand(n, len(ranges))
+        elif method == 'lhs':
+            # one value in each of n equal strata for each parameter, with the strata shuffled independently
+            unit = np.empty(shape=(n, len(ranges)))
+            for jj in xrange(len(ranges)):
+                unit[:, jj] = (rng.permutation(n) + rng.rand(n)) / n
+        else:
+            raise ValueError('unknown sampling method ' + method)
+
+        samples = lo + unit * (hi - lo)
+
+        indexes = []
+        for row in samples:
+            updates = [(r[0], val, r[1], r[2]) for r, val in zip(ranges, row)]
+            indexes.append(self.add_updates(updates))
+        return samples, indexes
+
+    # Save the member arrays (not the base) to a compressed .npz file
+    def save(self, fn):
+        arrays = {}
+        for ii, member in enumerate(self.members):
+            for name, vals in member.items():
+                arrays['%d:%s' % (ii, name)] = vals
+            for name, (indexes, values) in self.indexed[ii].items():
+                arrays['%d:%s:indexes' % (ii, name)] = indexes
+                arrays['%d:%s:values' % (ii, name)] = values
+        np.savez_compressed(fn, nmembers=len(self.members), **arrays)
+
+    # Add the members saved by save
+    def load(self, fn):
+        npz = np.load(fn)
+        first = len(self.members)
+        for ii in xrange(int(npz['nmembers'])):
+            self.members.append(collections.OrderedDict())
+            self.indexed.append(collections.OrderedDict())
+
+        for key in npz.files:
+            if key == 'nmembers':
+                continue
+            parts = key.split(':')
+            ii = first + int(parts[0])
+            if len(parts) == 2:
+                self.members[ii][parts[1]] = np.asfortranarray(npz[key])
+            elif parts[2] == 'indexes':
+                self.indexed[ii][parts[1]] = (npz[key], npz[key[:-len('indexes')] + 'values'])
+        npz.close()
+
+
+if __name__ == '__main__':
+    base = paramfile.ParamFile()
+    base.read('/work/markstro/intern_demo/ModelInput/skunk.params', lazy=True)
+
+    ens = ParamEnsemble(base)
+    samples, indexes = ens.sample([('tmax_allsnow', 30.0, 40.0), ('lat_temp_adj_1', -2.0, 2.0)], 100, method='lhs',
+                                  seed=1)
+    print ens.write_all('/work/markstro/intern_demo/ensemble/skunk_%04d.params')
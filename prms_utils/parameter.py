@@ -1,8 +1,25 @@
-class Parameter:
+import numpy
+
+
+class Parameter(object):
     def __init__(self):
         self.dims = []
-        self.vals = []
+        self._vals = numpy.array([])
         self.type_code = -1
         self.name = ""
+        # For a parameter that was read lazily (see ParamFile.read), the ParamFile that parses the values when they
+        # are first used. Setting vals detaches the parameter from it.
+        self.source = None
+        # checksum of the values as they were read from the file (see ParamFile.write)
+        self.checksum = None
 
+    @property
+    def vals(self):
+        if self.source is not None:
+            return self.source._get_vals(self)
+        return self._vals
 
+    @vals.setter
+    def vals(self, vals):
+        self.source = None
+        self._vals = vals
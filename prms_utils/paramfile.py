@@ -1,116 +1,370 @@
 import numpy
+import collections
+import mmap
+import os
 import re
+import zlib
 from parameter import Parameter
+from prms_utils import cache
+
+
+# Number of parameters that a lazily read ParamFile keeps parsed at a time. The least recently used ones are dropped
+# and parsed again if they are needed again.
+lazy_cache_size = 16
+
+# numpy types of the parameter values by type_code. Anything else (4) is a string.
+_dtypes = {1: int, 2: float, 3: float}
+
+
+# Parameter names that end in _## are one value of the parameter (one based index)
+_indexed_name = re.compile(r'^(.*)_(\d+)$')
+
+
+# Next line of text from pos, stripped. Returns the line and the position of the line after it.
+def _next_line(text, pos):
+    end = text.find('\n', pos)
+    if end < 0:
+        end = len(text)
+    return text[pos:end].strip(), end + 1
+
+
+# Scan the text of a parameter file. Returns the first two lines, the dimension sizes and, for each parameter,
+# [name, dims, number of values, type_code, begin, end] where text[begin:end] are the value lines.
+def _scan(text):
+    line1_end = text.find('\n') + 1
+    line2_end = text.find('\n', line1_end) + 1
+    line1 = text[:line1_end]
+    line2 = text[line1_end:line2_end]
+
+    # read the dimensions part
+    dims = collections.OrderedDict()
+    delim, pos = _next_line(text, line2_end)
+    delim, pos = _next_line(text, pos)
+    while delim != "** Parameters **":
+        dim, pos = _next_line(text, pos)
+        size, pos = _next_line(text, pos)
+        dims[dim] = int(size)
+        delim, pos = _next_line(text, pos)
+
+    blocks = []
+    delim, pos = _next_line(text, pos)
+    while delim:
+        name, pos = _next_line(text, pos)
+        num_dim, pos = _next_line(text, pos)
+        d = []
+        for ii in xrange(int(num_dim)):
+            dim, pos = _next_line(text, pos)
+            d.append(dim)
+        num_vals, pos = _next_line(text, pos)
+        type_t, pos = _next_line(text, pos)
+
+        # the values go up to the next block
+        end = text.find('####', pos)
+        if end < 0:
+            end = len(text)
+        blocks.append([name, d, int(num_vals), int(type_t), pos, end])
+
+        delim, pos = _next_line(text, end)
+
+    return line1, line2, dims, blocks
+
+
+# Parse the value lines of a parameter all at once into an array of the given shape (Fortran order)
+def _parse_vals(text, num_vals, type_t, shape, name):
+    if type_t in _dtypes:
+        vals = numpy.fromstring(text, dtype=_dtypes[type_t], sep=' ')
+    else:
+        vals = numpy.array([line.strip() for line in text.splitlines()[:num_vals]])
+
+    if vals.size != num_vals:
+        raise ValueError('expected ' + str(num_vals) + ' values for ' + name + ', found ' + str(vals.size))
+    return vals.reshape(shape, order='F')
+
+
+# Checksum of the values of a parameter
+def _checksum(vals):
+    return zlib.crc32(numpy.asfortranarray(vals))
+
+
+# Size and modification time of a file
+def _stat(fn):
+    st = os.stat(fn)
+    return st.st_size, st.st_mtime
+
+
+# The value lines of a parameter, all formatted at once. The formats are the same as str() of each numpy value.
+def _format_vals(vals, type_t):
+    vals = numpy.ravel(vals, order='F')
+    if type_t == 1:
+        strs = map(str, vals.astype(int).tolist())
+    elif type_t == 2 or type_t == 3:
+        if vals.dtype == numpy.float64:
+            strs = map(repr, vals.tolist())
+        else:
+            strs = [str(val) for val in vals]
+    elif type_t == 4:
+        strs = map(str, vals.tolist())
+    else:
+        strs = []
+
+    if not strs:
+        return ''
+    return '\n'.join(strs) + '\n'
+
+
+# Move the values of a parameter so that their mean goes to new_mean. Each value keeps its proportion of the distance
+# from the mean to hi (above the mean) or to lo (below it). Returns a new array.
+def rescale(vals, new_mean, lo, hi):
+    vals = numpy.asarray(vals, dtype=float)
+
+    # mean of parameter values across all dimensions
+    mean = numpy.mean(vals)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        # normalize the parameter values based on the range from the mean to the max
+        # and from the mean to the min depending on whether the individual value is
+        # above or below the mean.
+        dev_from_mean = vals - mean
+        proportion = numpy.where(dev_from_mean > 0.0, dev_from_mean / (hi - mean),
+                                 -1.0 * dev_from_mean / (lo - mean))
+
+        # redistribute the values based on proportion and the "new" parameter value
+        return numpy.where(proportion > 0.0, proportion * (hi - new_mean) + new_mean,
+                           -1.0 * proportion * (lo - new_mean) + new_mean)
+
+
+# The new values of the parameters of ps for a list of (param_name, new_mean, lo, hi) updates, without changing ps.
+# A name ending in _## sets that one value (one based, in file order) to new_mean, limited to lo and hi. Any other
+# name rescales the whole parameter (see rescale). The updates go in the order given. Returns a dictionary of
+# parameter name to new values.
+def updated_values(ps, updates):
+    new_vals = collections.OrderedDict()
+    # indexed updates waiting to be set, by parameter: [indexes], [values]
+    pending = {}
+
+    def flush(base):
+        if base in pending:
+            indexes, values = pending.pop(base)
+            flat = new_vals[base].reshape(-1, order='F')
+            flat[numpy.array(indexes) - 1] = values
+
+    for param_name, new_mean, lo, hi in updates:
+        m = _indexed_name.match(param_name)
+        base = m.group(1) if m is not None else param_name
+
+        if base not in new_vals:
+            new_vals[base] = numpy.array(ps.get_param_vals(base).vals, order='F')
+
+        if m is not None:
+            indexes, values = pending.setdefault(base, ([], []))
+            indexes.append(int(m.group(2)))
+            values.append(min(max(new_mean, lo), hi))
+        else:
+            flush(base)
+            new_vals[base] = numpy.asfortranarray(rescale(new_vals[base], new_mean, lo, hi))
+
+    for base in list(pending):
+        flush(base)
+    return new_vals
 
 
 class ParamFile:
     def __init__(self):
         # dims is a dictionary where the name is the key and the value is the integer size
-        self.dims = {}
+        self.dims = collections.OrderedDict()
         # params is a dictionary where the name is the key and the value is a Parameter() object
-        self.params = {}
+        self.params = collections.OrderedDict()
         # line1 is the first line of the parameter file
         self.line1 = ""
         # line2 is the second line of the parameter file
         self.line2 = ""
         self.file_name = ""
-
-    def read(self, pfn):
-        fp = open(pfn, "r")
+        # name to [number of values, begin, end] of the value lines of each parameter in the file
+        self._blocks = {}
+        # size and modification time of the file when it was read
+        self._source_stat = None
+        # lazily read parameters that have their values parsed, least recently used first
+        self._loaded = collections.OrderedDict()
+
+    # Read the parameter file pfn. With lazy, the file is only scanned for where each parameter is. The dimensions
+    # are there right away, and the values of a parameter are parsed the first time that its vals are used. Only
+    # lazy_cache_size parameters are kept parsed; the values of a parameter that has been changed are always kept.
+    def read(self, pfn, lazy=False):
         self.file_name = pfn
-        self.line1 = fp.readline()
-        self.line2 = fp.readline()
-
-        # read the dimensions part
-        fp.readline()
-        delim = fp.readline()
-
-        while delim != "** Parameters **":
-            dim = fp.readline().strip()
-            size = int(fp.readline().strip())
-            self.dims[dim] = size
-            delim = fp.readline().strip()
+        if cache.enabled and self._read_cache(pfn):
+            return
+
+        # binary mode throughout, so that the block offsets are byte offsets on Windows too (text mode there
+        # translates the line endings)
+        fp = open(pfn, "rb")
+        if lazy:
+            text = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            text = fp.read()
 
-        delim = fp.readline().strip()
-        while delim:
+        self.line1, self.line2, self.dims, blocks = _scan(text)
+        for name, dims, num_vals, type_t, begin, end in blocks:
             p = Parameter()
-            name = fp.readline().strip()
             p.name = name
-
-            num_dim = int(fp.readline().strip())
-            d = []
-            for ii in xrange(num_dim):
-                d.append(fp.readline().strip())
-            p.dims = d
-
-            num_vals = int(fp.readline().strip())
-            type_t = int(fp.readline().strip())
+            p.dims = dims
             p.type_code = type_t
+            self._blocks[name] = [num_vals, begin, end]
+            if lazy:
+                p.source = self
+                p._vals = None
+            else:
+                p.vals = _parse_vals(text[begin:end], num_vals, type_t, self._shape(dims, num_vals), name)
+                p.checksum = _checksum(p.vals)
+            self.params[name] = p
+        self._source_stat = _stat(pfn)
 
-            v = []
-            for ii in xrange(num_vals):
-                if type_t == 1:
-                    v.append(int(fp.readline().strip()))
-                elif type_t == 2:
-                    v.append(float(fp.readline().strip()))
-                else:
-                    v.append(fp.readline().strip())
-            p.vals = v
+        if lazy:
+            text.close()
+        fp.close()
 
+        if cache.enabled and not lazy:
+            self._write_cache(pfn)
+
+    # Values of a lazily read parameter, parsed from the file if they aren't already
+    def _get_vals(self, p):
+        if p.name in self._loaded:
+            del self._loaded[p.name]
+            self._loaded[p.name] = p
+            return p._vals
+
+        num_vals, begin, end = self._blocks[p.name]
+        with open(self.file_name, "rb") as fp:
+            fp.seek(begin)
+            text = fp.read(end - begin)
+        p._vals = _parse_vals(text, num_vals, p.type_code, self._shape(p.dims, num_vals), p.name)
+        p.checksum = _checksum(p._vals)
+        self._loaded[p.name] = p
+
+        # Drop the least recently used values. Ones that have been changed in place are kept.
+        while len(self._loaded) > lazy_cache_size:
+            name, old = self._loaded.popitem(last=False)
+            if _checksum(old._vals) == old.checksum:
+                old._vals = None
+            else:
+                old.source = None
+
+        return p._vals
+
+    # Shape of the values of a parameter with these dimensions, or just the number of values if the dimension sizes
+    # aren't all known or don't add up to it
+    def _shape(self, dims, num_vals):
+        if not all(dim in self.dims for dim in dims):
+            return (num_vals,)
+        shape = tuple(self.dims[dim] for dim in dims)
+        if numpy.prod(shape) != num_vals:
+            return (num_vals,)
+        return shape
+
+    def _read_cache(self, pfn):
+        cached = cache.load(pfn, 'ParamFile')
+        if cached is None:
+            return False
+
+        meta, arrays = cached
+        self.line1 = meta['line1']
+        self.line2 = meta['line2']
+        self.dims = collections.OrderedDict(meta['dims'])
+        for name, dims, type_code in meta['params']:
+            p = Parameter()
+            p.name = name
+            p.dims = dims
+            p.type_code = type_code
+            p.vals = arrays[name]
             self.params[name] = p
+        return True
+
+    def _write_cache(self, pfn):
+        meta = {'line1': self.line1, 'line2': self.line2, 'dims': self.dims.items(),
+                'params': [[p.name, p.dims, p.type_code] for p in self.params.values()]}
+        arrays = {}
+        for p in self.params.values():
+            arrays[p.name] = p.vals
+        cache.store(pfn, 'ParamFile', meta, arrays)
+
+    # True if the values of p are still the ones that were read from the file, so that its value lines can be copied
+    def _unchanged(self, p):
+        if p.name not in self._blocks:
+            return False
+        if p.source is self and p.name not in self._loaded:
+            return True
+
+        vals = p.vals
+        return numpy.size(vals) == self._blocks[p.name][0] and _checksum(vals) == p.checksum
+
+    # Write the parameter file. The value lines of the parameters that haven't changed since read are copied from the
+    # file that was read, and the rest are formatted a parameter at a time. pfn can be the file that was read; the
+    # new file is written next to it and then put in its place.
+    def write(self, pfn):
+        source = None
+        if self._blocks and os.path.exists(self.file_name) and _stat(self.file_name) == self._source_stat:
+            source = open(self.file_name, "rb")
 
-            delim = fp.readline().strip()
+        overwrite = source is not None and os.path.exists(pfn) and os.path.samefile(pfn, self.file_name)
+        out_fn = pfn + '.tmp' if overwrite else pfn
 
-    def write(self, pfn):
-        fp = open(pfn, "w")
+        # the file is written in binary mode, with the line ending of the file that was read (CRLF files stay CRLF)
+        nl = '\r\n' if self.line1.endswith('\r\n') else '\n'
+
+        fp = open(out_fn, "wb")
         fp.write(self.line1)
         fp.write(self.line2)
 
         # write the dimensions part
-        fp.write("** Dimensions **\n")
+        fp.write("** Dimensions **" + nl)
         for key in self.dims:
-            fp.write("####\n")
-            fp.write(key + '\n')
-            fp.write(str(self.dims[key]) + '\n')
+            fp.write("####" + nl + key + nl + str(self.dims[key]) + nl)
 
         # write the parameters part
-        fp.write("** Parameters **\n")
+        fp.write("** Parameters **" + nl)
+        blocks = {}
         for key in self.params:
             param = self.params[key]
 
-            fp.write("####\n")
-            fp.write(key + '\n')
-            fp.write(str(len(param.dims)) + '\n')
-            for dim in param.dims:
-                fp.write(dim + '\n')
-            fp.write(str(len(param.vals)) + '\n')
-            fp.write(str(param.type_code) + '\n')
-
-            # print "paramfile " + key + " type_code " + str(param.type_code)
-
-            if param.type_code == 1:
-                # write int
-                for val in param.vals:
-                    fp.write(str(int(val)) + '\n')
-                    # print str(int(val))
-
-            elif param.type_code == 2:
-                # write float
-                for val in param.vals:
-                    fp.write(str(val) + '\n')
-
-            elif param.type_code == 3:
-                # write double?
-                for val in param.vals:
-                    fp.write(str(val) + '\n')
-
-            elif param.type_code == 4:
-                # write string?
-                for val in param.vals:
-                    fp.write(str(val) + '\n')
+            if source is not None and self._unchanged(param):
+                num_vals, begin, end = self._blocks[key]
+                source.seek(begin)
+                text = source.read(end - begin)
+                if text and not text.endswith('\n'):
+                    text += nl
+            else:
+                num_vals = numpy.size(param.vals)
+                text = _format_vals(param.vals, param.type_code)
+                if nl != '\n':
+                    text = text.replace('\n', nl)
+                if overwrite:
+                    param.checksum = _checksum(param.vals)
+
+            # the values go into the file in Fortran order (first dimension fastest)
+            header = ["####", key, str(len(param.dims))] + param.dims + [str(num_vals), str(param.type_code)]
+            fp.write(nl.join(header) + nl)
+            begin = fp.tell()
+            fp.write(text)
+            blocks[key] = [num_vals, begin, begin + len(text)]
 
         fp.close()
 
+        if overwrite:
+            source.close()
+            source = None
+            try:
+                os.rename(out_fn, pfn)
+            except OSError:
+                # Windows won't rename over an existing file
+                os.remove(pfn)
+                os.rename(out_fn, pfn)
+
+            # the value lines are now where they went in the new file
+            self._blocks = blocks
+            self._source_stat = _stat(pfn)
+
+        if source is not None:
+            source.close()
+
     def get_param_vals(self, name):
         return self.params[name]
 
@@ -120,69 +374,15 @@ class ParamFile:
         else:
             return -1
 
+    # args are name of parameter, new value, minimum, maximum (see updated_values)
     def update_param_value(self, param_name, new_mean, lo, hi):
-        # if parameter name ends in _## then this is an index optimization
-        result = re.search(r'_\d+$', param_name)
-
-        # if the string ends in digits m will be a Match object, or None otherwise.
-        if result is not None:
-            # get the index
-            m = re.search(r'\d+$', param_name)
-            ii = int(m.group())
-            # print str(ii)
-
-            # get the parameter base name without index
-            base = re.sub(result.group(), '', param_name)
-            # print base
+        self.update_param_values([(param_name, new_mean, lo, hi)])
 
-
-            # get the list of param values from file
-            p = self.get_param_vals(base)
-            params = p.vals
-
-            if new_mean > hi:
-                params[ii-1] = hi
-            elif new_mean < lo:
-                params[ii - 1] = lo
-            else:
-                params[ii - 1] = new_mean
-
-            p.vals = params
-
-        else:
-            # This will set all of the values of array to single value
-            # get the list of param values from file
-            p = self.get_param_vals(param_name)
-            params = p.vals
-
-            # mean of parameter values across all dimensions
-            mean = numpy.mean(params)
-
-            # list of parameter values as their difference from the overall mean
-            dev_from_mean = params - mean
-
-            # normalize the parameter values based on the range from the mean to the max
-            # and from the mean to the min depending on whether the individual value is
-            # above or below the mean.
-            proportion = []
-            for ii in xrange(len(params)):
-                if dev_from_mean[ii] > 0.0:
-                    proportion.append(dev_from_mean[ii] / (hi - mean))
-                else:
-                    proportion.append(-1.0 * dev_from_mean[ii] / (lo - mean))
-
-            # redistribute the values based on proportion and the "new" parameter value
-            new_params = []
-            print len(proportion)
-            for ii in xrange(len(proportion)):
-                if proportion[ii] > 0.0:
-                    new_params.append(proportion[ii] * (hi - new_mean) + new_mean)
-                else:
-                    new_params.append(-1.0 * proportion[ii] * (lo - new_mean) + new_mean)
-
-            # print params
-            # print new_params
-            p.vals = new_params
+    # Apply a list of (param_name, new_mean, lo, hi) updates at once. Each parameter is changed one time, however
+    # many of its values are in the list.
+    def update_param_values(self, updates):
+        for name, vals in updated_values(self, updates).items():
+            self.params[name].vals = vals
 
 
 if __name__ == '__main__':
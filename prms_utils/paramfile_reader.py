@@ -1,52 +1,45 @@
 import numpy as np
 import datetime
+import collections
+from prms_utils import paramfile as pf
 
 
-class paramfile:
+# Read only mapping of parameter name to values. The values of a parameter are only parsed when they are looked up.
+class _ParamVals(collections.Mapping):
+    def __init__(self, params):
+        self._params = params
+
+    def __getitem__(self, name):
+        return self._params[name].vals
+
+    def __contains__(self, name):
+        return name in self._params
+
+    def __iter__(self):
+        return iter(self._params)
+
+    def __len__(self):
+        return len(self._params)
+
+
+# Older interface to a parameter file, on top of paramfile.ParamFile. Reads lazily by default, so only the
+# parameters that are asked for get parsed.
+class paramfile(object):
     def __init__(self):
-        self.dims = {}
-        self.params = {}
-
-    def read(self, pfn):
-        fp = open(pfn, "r")
-        line1 = fp.readline()
-        line2 = fp.readline()
-
-        # read the dimensions part
-        fp.readline()
-        delim = fp.readline()
-
-
-        while delim != "** Parameters **":
-            dim = fp.readline().strip()
-            size = int(fp.readline().strip())
-            self.dims[dim] = size
-            delim = fp.readline().strip()
-
-        delim = fp.readline().strip()
-        while delim:
-            param = fp.readline().strip()
-            num_dim = int(fp.readline().strip())
-            d = []
-            for ii in xrange(num_dim):
-                d.append(fp.readline().strip())
-            num_vals = int(fp.readline().strip())
-            type = int(fp.readline().strip())
-            v = []
-            for ii in xrange(num_vals):
-                if type == 1:
-                    v.append(int(fp.readline().strip()))
-                elif type == 2:
-                    v.append(float(fp.readline().strip()))
-                else:
-                    v.append(fp.readline().strip())
-
-            self.params[param] = v
-
-            delim = fp.readline().strip()
+        self.pf = pf.ParamFile()
+        self.dims = self.pf.dims
+
+    def read(self, pfn, lazy=True):
+        self.pf.read(pfn, lazy)
+        self.dims = self.pf.dims
+
+    # Mapping of parameter name to values. Looking up a parameter parses only that one.
+    @property
+    def params(self):
+        return _ParamVals(self.pf.params)
 
     def get_param_vals(self, name):
-        return self.params[name]
+        return self.pf.params[name].vals
 
     def get_dim_size(self, name):
         return self.dims[name]
@@ -1,64 +1,160 @@
 import numpy as np
-import datetime
-
-
-def read(svfn):
-    fp = open(svfn, "r")
-    var_count = int(fp.readline())
-    # print var_count
-
-    # allocate the arrays numpy.ndarray
-    var_names = np.empty([var_count], dtype='a80')
-    var_indexes = np.empty([var_count], dtype=int)
-
-# read header
-    for ii in xrange(0, var_count):
-        line = fp.readline()
-        split = line.split()
-        var_names[ii] = split[0]
-        var_indexes[ii] = int(split[1])
-
-        # print var_names[ii], var_indexes[ii]
-
-# count value lines
-    count = 0
-    for line in fp:
-        count += 1
-
-# rewind the file
-    fp.close()
-    fp = open(svfn, "r")
-    fp.readline()
-    for ii in xrange(0, var_count):
-        fp.readline()
-
-# read values
-    dates = np.empty([count], dtype=datetime.datetime)
-
-    r = count
-    c = var_count
-    vals = np.empty(shape=(r,c), dtype=float)
-
-    for ii in xrange(0, count):
-        line = fp.readline().strip()
-        # print(repr(line))
-        sp = line.split()
-        foo = datetime.datetime(int(sp[1]), int(sp[2]), int(sp[3]))
-        # dates[ii] = str(sp[1])+ "-" + str(sp[2]).zfill(2) + "-"  + str(sp[3]).zfill(2)
-        # print "statvar_reader date = ", foo
-        dates[ii] = foo
-
-        for jj in xrange(0, var_count):
-            # Fortran will write "-1.#IND00" into the statvar file and maybe some other
-            # string if the model breaks. I don't want these reader to choke if it hits
-            # something other than a float value. The user's should get some kind of
-            # message if this happens, but don't stop.
-            try:
-                vals[ii, jj] = float(sp[7 + jj])
-            except ValueError:
-                vals[ii, jj] = np.NaN
-                print "value error in " + svfn
-                print "   " + line
-
-    fp.close()
-    return var_names, var_indexes, dates, vals
+import re
+import itertools
+from prms_utils import cache
+from prms_utils import date_index
+from prms_utils import follow
+
+# Number of lines to parse at a time. Only the selected columns of each chunk are kept, so this bounds the memory
+# that is used for the columns that are thrown away.
+chunk_size = 10000
+
+# A token that is not a number (nan and inf are numbers). Fortran will write "-1.#IND00" into the statvar file and maybe
+# some other string if the model breaks.
+_not_a_number = re.compile(r'(?<!\S)(?![-+]?(?:(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|nan|inf(?:inity)?)(?!\S))\S+',
+                           re.IGNORECASE)
+
+
+# Date of a line of a statvar file, for the date index
+def _statvar_date(line):
+    y, m, d = line.split(None, 4)[1:4]
+    return int(y), int(m), int(d)
+
+
+# Parse a chunk of statvar lines into a (nlines, ncol) array, all at once. I don't want this reader to choke if it hits
+# something other than a float value, so if there are any, they are all replaced with NaN (in one regular expression
+# pass) and the chunk is parsed again. The user gets a message when this happens, but it doesn't stop.
+def _parse_lines(lines, ncol, svfn):
+    text = ''.join(lines)
+    nlines = sum(1 for line in lines if line.strip())
+
+    vals = np.fromstring(text, dtype=float, sep=' ')
+    if vals.size != nlines * ncol:
+        print "value error in " + svfn
+        vals = np.fromstring(_not_a_number.sub('nan', text), dtype=float, sep=' ')
+
+    return vals.reshape(nlines, ncol)
+
+
+# Find the columns of the (name, index) pairs in var_list
+def _select(var_names, var_indexes, var_list, svfn):
+    col_of_var = dict(zip(zip(var_names, var_indexes), xrange(len(var_names))))
+    try:
+        return np.array([col_of_var[(name, int(index))] for name, index in var_list], dtype=int)
+    except KeyError as e:
+        raise ValueError(str(e.args[0]) + ' is not in ' + svfn)
+
+
+# Read a statvar file. Returns the variable names and indexes, the dates (datetime64[D]) and a (nts, nvars) array
+# of the values. Values that are not numbers come back as NaN.
+#
+# var_list is an optional list of (var_name, index) pairs. When it is given, only those columns are kept, in that
+# order.
+#
+# start and end limit the read to the dates from start to end (inclusive). The date index (see date_index.py) is used
+# to seek straight to start. These reads don't go through the cache.
+def read(svfn, var_list=None, start=None, end=None):
+    windowed = start is not None or end is not None
+    if cache.enabled and not windowed:
+        cached = cache.load(svfn, 'statvar')
+        if cached is not None:
+            meta, arrays = cached
+            var_names = arrays['var_names']
+            var_indexes = arrays['var_indexes']
+            vals = arrays['vals']
+            if var_list is not None:
+                cols = _select(var_names, var_indexes, var_list, svfn)
+                var_names, var_indexes, vals = var_names[cols], var_indexes[cols], vals[:, cols]
+            return var_names, var_indexes, arrays['dates'], vals
+
+    with open(svfn, 'rb') as fp:
+        var_count = int(fp.readline())
+
+        # allocate the arrays numpy.ndarray
+        var_names = np.empty([var_count], dtype='a80')
+        var_indexes = np.empty([var_count], dtype=int)
+
+        # read header
+        for ii in xrange(0, var_count):
+            split = fp.readline().split()
+            var_names[ii] = split[0]
+            var_indexes[ii] = int(split[1])
+
+        cols = np.arange(var_count)
+        if var_list is not None:
+            cols = _select(var_names, var_indexes, var_list, svfn)
+
+        if windowed:
+            row0, row1, begin, stop = date_index.window(svfn, fp.tell(), _statvar_date, start, end)
+            fp.seek(begin)
+            lines = itertools.islice(fp, row1 - row0)
+        else:
+            lines = fp
+
+        # Each line is the time step number, the date/time (6 fields) and then the values. Keep the date and the
+        # values of the selected columns from each chunk.
+        date_chunks = []
+        val_chunks = []
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                break
+            block = _parse_lines(chunk, 7 + var_count, svfn)
+            date_chunks.append(block[:, 1:4])
+            val_chunks.append(block[:, 7 + cols])
+
+    if val_chunks:
+        dates = date_index.to_datetime64(np.concatenate(date_chunks))
+        vals = np.concatenate(val_chunks)
+    else:
+        dates = np.empty([0], dtype='datetime64[D]')
+        vals = np.empty([0, len(cols)])
+
+    if cache.enabled and not windowed and var_list is None:
+        cache.store(svfn, 'statvar', {}, {'var_names': var_names, 'var_indexes': var_indexes,
+                                          'dates': dates, 'vals': vals})
+    return var_names[cols], var_indexes[cols], dates, vals
+
+
+# Follow a statvar file that a running model is writing. Each poll() returns (dates, vals) for the time steps that were
+# added since the last poll. var_list selects columns the same way as in read.
+class StatvarFollower(follow.Follower):
+    def __init__(self, svfn, var_list=None):
+        follow.Follower.__init__(self, svfn)
+        self.var_list = var_list
+        self.var_names = None
+        self.var_indexes = None
+        self.cols = None
+
+    def _read_header(self, fp):
+        line = follow.read_complete_line(fp)
+        if line is None:
+            return False
+        var_count = int(line)
+
+        var_names = np.empty([var_count], dtype='a80')
+        var_indexes = np.empty([var_count], dtype=int)
+        for ii in xrange(0, var_count):
+            line = follow.read_complete_line(fp)
+            if line is None:
+                return False
+            split = line.split()
+            var_names[ii] = split[0]
+            var_indexes[ii] = int(split[1])
+
+        self.cols = np.arange(var_count)
+        if self.var_list is not None:
+            self.cols = _select(var_names, var_indexes, self.var_list, self.fn)
+
+        self.var_names = var_names[self.cols]
+        self.var_indexes = var_indexes[self.cols]
+        self.var_count = var_count
+        return True
+
+    def _parse(self, lines):
+        if self.cols is None or not lines:
+            ncol = 0 if self.cols is None else len(self.cols)
+            return np.empty([0], dtype='datetime64[D]'), np.empty([0, ncol])
+
+        block = _parse_lines(lines, 7 + self.var_count, self.fn)
+        return date_index.to_datetime64(block[:, 1:4]), block[:, 7 + self.cols]
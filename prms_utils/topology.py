@@ -0,0 +1,136 @@
+import numpy as np
+from prms_utils import cache
+from prms_utils import paramfile
+
+# Stream network topology from the tosegment and hru_segment parameters.
+#
+# tosegment gives, for each segment, the (one based) segment that it flows into, or 0 for an outlet. hru_segment
+# gives, for each HRU, the segment that it flows into, or 0 for none. From these, the segments are put into the order
+# of a depth first walk down from the outlets (the "tour"), with each segment before everything upstream of it. Then
+# all of the segments upstream of a segment (it included) are the next size[seg] segments of the tour, and the HRUs,
+# sorted by the tour position of their segment, line up the same way. An upstream query is two array slices.
+
+
+# Depth first walk of the network. parent is the zero based downstream segment of each segment (-1 for an outlet).
+# Returns the children of each segment (CSR: children[child_ptr[ii]:child_ptr[ii + 1]]), the tour, the position of
+# each segment in the tour and the number of segments upstream of (and including) each segment.
+def _walk(parent):
+    nseg = len(parent)
+
+    # outlets sort first, then the children grouped by segment
+    order = np.argsort(parent, kind='mergesort')
+    nroots = int(np.sum(parent < 0))
+    children = order[nroots:]
+    child_ptr = np.zeros(nseg + 1, dtype=int)
+    child_ptr[1:] = np.cumsum(np.bincount(parent[parent >= 0], minlength=nseg))
+
+    tour = np.empty(nseg, dtype=int)
+    pos = 0
+    stack = order[:nroots][::-1].tolist()
+    while stack:
+        seg = stack.pop()
+        tour[pos] = seg
+        pos += 1
+        stack.extend(children[child_ptr[seg]:child_ptr[seg + 1]][::-1].tolist())
+
+    if pos != nseg:
+        raise ValueError('tosegment has a loop in it')
+
+    first = np.empty(nseg, dtype=int)
+    first[tour] = np.arange(nseg)
+
+    # sizes, from the top of the network down
+    size = np.ones(nseg, dtype=int)
+    for seg in tour[::-1].tolist():
+        if parent[seg] >= 0:
+            size[parent[seg]] += size[seg]
+
+    return children, child_ptr, tour, first, size
+
+
+class Topology(object):
+    # tosegment and hru_segment are the values of those parameters (one based segment ids, 0 for none)
+    def __init__(self, tosegment=None, hru_segment=None):
+        if tosegment is None:
+            return
+
+        tosegment = np.asarray(tosegment, dtype=int)
+        hru_segment = np.asarray(hru_segment, dtype=int)
+        self.nsegment = len(tosegment)
+        self.nhru = len(hru_segment)
+
+        self.tosegment = tosegment
+        self.hru_segment = hru_segment
+        self.children, self.child_ptr, self.tour, self.first, self.size = _walk(tosegment - 1)
+
+        # HRUs (zero based) by the tour position of their segment. HRUs that aren't connected to a segment are left
+        # out. The HRUs of tour position ii are hru_order[hru_ptr[ii]:hru_ptr[ii + 1]].
+        connected = np.nonzero(hru_segment > 0)[0]
+        hru_pos = self.first[hru_segment[connected] - 1]
+        self.hru_order = connected[np.argsort(hru_pos, kind='mergesort')]
+        self.hru_ptr = np.zeros(self.nsegment + 1, dtype=int)
+        self.hru_ptr[1:] = np.cumsum(np.bincount(hru_pos, minlength=self.nsegment))
+
+    # Segment ids (one based) of seg and everything upstream of it, in tour order (seg first)
+    def upstream_segments(self, seg):
+        ii = self.first[seg - 1]
+        return self.tour[ii:ii + self.size[seg - 1]] + 1
+
+    # HRU ids (one based) of the HRUs that flow into seg or anything upstream of it
+    def upstream_hrus(self, seg):
+        ii = self.first[seg - 1]
+        return self.hru_order[self.hru_ptr[ii]:self.hru_ptr[ii + self.size[seg - 1]]] + 1
+
+    # Segment ids (one based) that flow straight into seg
+    def upstream_neighbors(self, seg):
+        return self.children[self.child_ptr[seg - 1]:self.child_ptr[seg]] + 1
+
+    # True if seg_up is seg or upstream of it
+    def is_upstream(self, seg_up, seg):
+        ii = self.first[seg - 1]
+        return ii <= self.first[seg_up - 1] < ii + self.size[seg - 1]
+
+    # Upstream segments for each of a list of outlets. Returns a dictionary of outlet id to segment ids.
+    def upstream_segments_many(self, outlets):
+        return dict((seg, self.upstream_segments(seg)) for seg in outlets)
+
+    # Upstream HRUs for each of a list of outlets. Returns a dictionary of outlet id to HRU ids.
+    def upstream_hrus_many(self, outlets):
+        return dict((seg, self.upstream_hrus(seg)) for seg in outlets)
+
+    def _arrays(self):
+        return {'tosegment': self.tosegment, 'hru_segment': self.hru_segment, 'children': self.children,
+                'child_ptr': self.child_ptr, 'tour': self.tour, 'first': self.first, 'size': self.size,
+                'hru_order': self.hru_order, 'hru_ptr': self.hru_ptr}
+
+
+# Build the topology of the parameter file pfn. With the cache enabled, the index is saved next to the parameter file
+# and loaded from there the next time, without reading the parameter file again. Only tosegment and hru_segment are
+# parsed (the file is read lazily). pf is an already read ParamFile of pfn to take them from.
+def read(pfn, pf=None):
+    if cache.enabled:
+        cached = cache.load(pfn, 'topology')
+        if cached is not None:
+            meta, arrays = cached
+            topo = Topology()
+            topo.nsegment = meta['nsegment']
+            topo.nhru = meta['nhru']
+            for name in arrays:
+                setattr(topo, name, arrays[name])
+            return topo
+
+    if pf is None:
+        pf = paramfile.ParamFile()
+        pf.read(pfn, lazy=True)
+    topo = Topology(pf.params['tosegment'].vals, pf.params['hru_segment'].vals)
+
+    if cache.enabled:
+        cache.store(pfn, 'topology', {'nsegment': topo.nsegment, 'nhru': topo.nhru}, topo._arrays())
+    return topo
+
+
+if __name__ == '__main__':
+    topo = read('/work/markstro/operat/setup/test/NHM-PRMS_CONUS/input/myparam.param')
+    print topo.nsegment, topo.nhru
+    print topo.upstream_segments(1500)
+    print topo.upstream_hrus(1500)